@@ -1,3 +1,11 @@
+import os
+import mmap
+import time
+import array
+import random
+import concurrent.futures
+
+
 GLOBALS = "report".split()
 PATTERNS = [
     ("P[:n]", "#P _{#n}"),
@@ -70,3 +78,412 @@ def kmp(T, P):
     positions = []
     find_matches(T, P, pi, positions.append)
     return positions
+
+
+def _compute_prefix_fast(P):
+    """
+    compute_prefix without the invariant checks, which take time
+    proportional to i in iteration i.
+
+    >>> all(_compute_prefix_fast(P) == compute_prefix(P)
+    ...     for P in ['abcababcabc', 'ababaca', 'aabaacaabaaa', 'a'])
+    True
+    """
+    m = len(P)
+    pi = [-1] * m
+    k = -1
+    for i in range(1, m):
+        c = P[i]
+        while k > -1 and c != P[k + 1]:
+            k = pi[k]
+        if P[k + 1] == c:
+            k = k + 1
+        pi[i] = k
+    return pi
+
+
+def _find_matches_fast(T, P, pi, report):
+    """
+    find_matches without the invariant checks.
+    """
+    m = len(P)
+    k = -1
+    for i, c in enumerate(T):
+        while k >= 0 and c != P[k + 1]:
+            k = pi[k]
+        if c == P[k + 1]:
+            k = k + 1
+        if k + 1 == m:
+            report(i - k)
+            k = pi[k]
+
+
+def _kmp_fast(T, P):
+    """
+    kmp without the invariant checks, running in time O(len(T) + len(P)).
+
+    >>> _kmp_fast('fooobar', 'oo')
+    [1, 2]
+    >>> _kmp_fast('abcabcababcabcababcabc', 'abcababcabc')
+    [3, 11]
+    >>> _kmp_fast('aaa', 'a')
+    [0, 1, 2]
+    >>> import random
+    >>> rng = random.Random(0)
+    >>> T = ''.join(rng.choice('ab') for i in range(1000))
+    >>> all(_kmp_fast(T, T[i:i + n]) == kmp(T, T[i:i + n])
+    ...     for i in range(0, 1000, 97) for n in [1, 2, 5, 13])
+    True
+    """
+    pi = _compute_prefix_fast(P)
+    positions = []
+    _find_matches_fast(T, P, pi, positions.append)
+    return positions
+
+
+def _compute_automaton(Ps):
+    """
+    Build the Aho-Corasick automaton for the list of patterns Ps: a trie
+    of the patterns with goto[q][c] the child of state q on character c,
+    fail[q] the longest proper suffix of state q that is a state (the
+    analogue of pi), out[q] the indices of the patterns ending at q, and
+    link[q] the nearest state on the fail chain of q with nonempty out.
+
+    >>> goto, fail, out, link = _compute_automaton(['he', 'she', 'his', 'hers'])
+    >>> len(goto), fail
+    (10, [0, 0, 0, 0, 1, 2, 0, 3, 0, 3])
+    >>> out, link
+    ([[], [], [0], [], [], [1], [], [2], [], [3]], [0, 0, 0, 0, 0, 2, 0, 0, 0, 0])
+    """
+    goto = [{}]
+    out = []
+    out.append([])
+    for j in range(len(Ps)):
+        q = 0
+        for c in Ps[j]:
+            if c not in goto[q]:
+                goto[q][c] = len(goto)
+                goto.append({})
+                out.append([])
+            q = goto[q][c]
+        out[q].append(j)
+    fail = [0] * len(goto)
+    link = [0] * len(goto)
+    # Visit the states in order of depth; order grows while it is visited
+    order = list(goto[0].values())
+    for r in order:
+        for c, q in goto[r].items():
+            order.append(q)
+            k = fail[r]
+            while k > 0 and c not in goto[k]:
+                k = fail[k]
+            if r > 0 and c in goto[k]:
+                fail[q] = goto[k][c]
+            if len(out[fail[q]]) > 0:
+                link[q] = fail[q]
+            else:
+                link[q] = link[fail[q]]
+    return goto, fail, out, link
+
+
+def _find_all_matches(T, Ps, goto, fail, out, link, report):
+    """
+    Call report(j, s) for every shift s with which Ps[j] occurs in T,
+    in order of the end of the occurrence, longest pattern first.
+    """
+    q = 0
+    for i in range(len(T)):
+        while q > 0 and T[i] not in goto[q]:
+            q = fail[q]
+        if T[i] in goto[q]:
+            q = goto[q][T[i]]
+        r = q
+        while r > 0:
+            for j in out[r]:
+                report(j, i - len(Ps[j]) + 1)
+            r = link[r]
+
+
+def _aho_corasick(T, Ps):
+    """
+    >>> _aho_corasick('ushers', ['he', 'she', 'his', 'hers'])
+    [(1, 1), (0, 2), (3, 2)]
+    >>> _aho_corasick('aaa', ['a', 'aa', 'a'])
+    [(0, 0), (2, 0), (1, 0), (0, 1), (2, 1), (1, 1), (0, 2), (2, 2)]
+    >>> T = 'abcabcababcabcababcabc'
+    >>> Ps = ['abcababcabc', 'oo', 'bca', 'c']
+    >>> matches = _aho_corasick(T, Ps)
+    >>> all(sorted(s for i, s in matches if i == j) == kmp(T, Ps[j])
+    ...     for j in range(len(Ps)))
+    True
+    """
+    goto, fail, out, link = _compute_automaton(Ps)
+    matches = []
+
+    def report(j, s):
+        matches.append((j, s))
+
+    _find_all_matches(T, Ps, goto, fail, out, link, report)
+    return matches
+
+
+class StreamingKMP:
+    """
+    Search for P in a text that arrives in chunks, calling report(s) for
+    every shift s of an occurrence of P relative to the start of the
+    whole text. Only the state k of find_matches is kept between calls,
+    so P may be a str searched in str chunks, or bytes searched in
+    bytes, bytearray, memoryview or mmap chunks.
+
+    >>> positions = []
+    >>> matcher = StreamingKMP('abcababcabc', positions.append)
+    >>> T = 'abcabcababcabcababcabc'
+    >>> for i in range(0, len(T), 4):
+    ...     matcher.feed(T[i:i + 4])
+    >>> positions == kmp(T, 'abcababcabc'), matcher.offset
+    (True, 22)
+    >>> import io
+    >>> positions = []
+    >>> StreamingKMP(b'oo', positions.append).feed_file(io.BytesIO(b'fooobar'), 2)
+    >>> positions
+    [1, 2]
+    """
+
+    def __init__(self, P, report):
+        self.P = P
+        self.pi = _compute_prefix_fast(P)
+        self.report = report
+        self.k = -1
+        self.offset = 0
+
+    def feed(self, chunk):
+        P = self.P
+        pi = self.pi
+        report = self.report
+        m = len(P)
+        k = self.k
+        offset = self.offset
+        for i, c in enumerate(chunk):
+            while k >= 0 and c != P[k + 1]:
+                k = pi[k]
+            if c == P[k + 1]:
+                k = k + 1
+            if k + 1 == m:
+                report(offset + i - k)
+                k = pi[k]
+        self.k = k
+        self.offset = offset + len(chunk)
+
+    def feed_file(self, fp, chunk_size=1 << 16):
+        """
+        Read the binary file object `fp` to the end in chunks of at most
+        `chunk_size` bytes, reusing a single buffer.
+        """
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = fp.readinto(buf)
+            if not n:
+                break
+            self.feed(view[:n])
+
+    def feed_mmap(self, fp):
+        """
+        Memory-map the binary file object `fp` and search all of it,
+        leaving it to the operating system to page the file in and out.
+        """
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            return
+        with mm, memoryview(mm) as view:
+            self.feed(view)
+
+
+class ByteKMP:
+    """
+    KMP for a bytes pattern P compiled into a DFA with len(P) + 1 states
+    and 256 symbols, so that each byte of the text costs one table lookup
+    instead of a loop over failure links. The table is a flat array in
+    which each state is stored as the offset of its row.
+
+    >>> for T, P in [('fooobar', 'oo'), ('abcabcababcabcababcabc', 'abcababcabc'),
+    ...              ('aaa', 'a'), ('ababababa', 'aba')]:
+    ...     assert ByteKMP(P.encode()).search(T.encode()) == kmp(T, P), (T, P)
+    >>> ByteKMP(b'oo').search(memoryview(b'fooobar'))
+    [1, 2]
+    """
+
+    def __init__(self, P):
+        if not P:
+            raise ValueError("empty pattern")
+        m = len(P)
+        table = array.array("l", [0]) * (256 * (m + 1))
+        # x is the state reached on P[1:q], from which state q falls back
+        x = 0
+        for q in range(m + 1):
+            row = 256 * q
+            table[row : row + 256] = table[256 * x : 256 * x + 256]
+            if q < m:
+                table[row + P[q]] = 256 * (q + 1)
+                if q > 0:
+                    x = table[256 * x + P[q]] // 256
+        self.P = P
+        self.table = table
+        self.accept = 256 * m
+
+    def find(self, data, report):
+        """
+        Call report(s) for every shift s of an occurrence of P in the
+        bytes-like object `data`.
+        """
+        table = self.table
+        accept = self.accept
+        m = len(self.P)
+        q = 0
+        with memoryview(data) as view:
+            for i, c in enumerate(view.cast("B")):
+                q = table[q + c]
+                if q == accept:
+                    report(i - m + 1)
+
+    def search(self, data):
+        positions = []
+        self.find(data, positions.append)
+        return positions
+
+    def search_file(self, path, jobs=None, chunk_size=1 << 24):
+        """
+        Return the shifts of all occurrences of P in the file at `path`,
+        searching chunks of `chunk_size` bytes in a pool of `jobs`
+        processes. Each process maps the file itself, so the text is
+        never pickled. Chunk [a, b) is searched together with the first
+        len(P) - 1 bytes of the next chunk, and owns exactly the matches
+        with shifts in [a, b), so no match is reported twice.
+
+        >>> import os, tempfile
+        >>> T = b'abcabcababcabcababcabc' * 5
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     path = os.path.join(d, 'text')
+        ...     with open(path, 'wb') as fp:
+        ...         n = fp.write(T)
+        ...     M = ByteKMP(b'abcababcabc')
+        ...     M.search_file(path, jobs=2, chunk_size=7) == M.search(T)
+        True
+        """
+        size = os.path.getsize(path)
+        starts = range(0, size, chunk_size)
+        args = [(path, self.P, a, min(a + chunk_size, size)) for a in starts]
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = executor.map(_search_file_chunk, *zip(*args))
+            return [s for positions in results for s in positions]
+
+
+def _search_file_chunk(path, P, start, end):
+    with open(path, "rb") as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm)[start : end + len(P) - 1] as view:
+                return [start + s for s in ByteKMP(P).search(view)]
+
+
+def _timed(f, *args):
+    t = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - t
+
+
+def _benchmark_aho_corasick():
+    """
+    Search a random text of length 10^4 for k random patterns, once with
+    _aho_corasick and once with kmp per pattern.
+    """
+    rng = random.Random(0)
+    T = "".join(rng.choice("abcd") for i in range(10000))
+    print("%6s %10s %10s" % ("k", "kmp", "aho"))
+    for k in [1, 10, 100]:
+        Ps = ["".join(rng.choice("abcd") for i in range(8)) for j in range(k)]
+        r1, t1 = _timed(lambda: [kmp(T, P) for P in Ps])
+        r2, t2 = _timed(_aho_corasick, T, Ps)
+        assert sum(map(len, r1)) == len(r2)
+        print("%6s %10.3f %10.3f" % (k, t1, t2))
+
+
+def _benchmark_streaming():
+    """
+    Search a 16 MB file of random bytes with StreamingKMP, reading it in
+    buffered chunks and through mmap.
+    """
+    import tempfile
+
+    rng = random.Random(0)
+    P = b"abcabd"
+    with tempfile.TemporaryFile() as fp:
+        for i in range(16):
+            fp.write(bytes(rng.choice(b"abcd") for j in range(1 << 20)))
+        for method in ["feed_file", "feed_mmap"]:
+            fp.seek(0)
+            positions = []
+            matcher = StreamingKMP(P, positions.append)
+            _, t = _timed(getattr(matcher, method), fp)
+            print("%10s %8.3f s %8s matches" % (method, t, len(positions)))
+
+
+def _benchmark_fast():
+    """
+    Time kmp and _kmp_fast on texts of growing length. The invariant
+    checks in kmp slice the text read so far, so its running time grows
+    quadratically, while _kmp_fast grows linearly.
+    """
+    P = "a" * 20 + "b"
+    print("%8s %10s %10s" % ("n", "kmp", "_kmp_fast"))
+    for n in [4000, 16000, 64000, 256000]:
+        T = "a" * n
+        r1, t1 = _timed(kmp, T, P)
+        r2, t2 = _timed(_kmp_fast, T, P)
+        assert r1 == r2
+        print("%8s %10.3f %10.3f" % (n, t1, t2))
+
+
+def _benchmark_bytes():
+    """
+    Compare _kmp_fast on a str with ByteKMP on the same text as bytes.
+    """
+    rng = random.Random(0)
+    T = "".join(rng.choice("abcd") for i in range(1 << 20))
+    B = T.encode()
+    for P in ["abcabd", "a" * 20 + "b"]:
+        r1, t1 = _timed(_kmp_fast, T, P)
+        r2, t2 = _timed(ByteKMP(P.encode()).search, B)
+        assert r1 == r2
+        print("%24s %8.3f s %8.3f s" % (P, t1, t2))
+
+
+def _benchmark_parallel():
+    """
+    Search a 16 MB file of random bytes with ByteKMP.search_file using
+    different numbers of processes.
+    """
+    import tempfile
+
+    rng = random.Random(0)
+    block = bytes(rng.choice(b"abcd") for j in range(1 << 20))
+    P = b"abcabd"
+    with tempfile.NamedTemporaryFile() as fp:
+        for i in range(16):
+            fp.write(block)
+        fp.flush()
+        M = ByteKMP(P)
+        expected = None
+        for jobs in [1, 2, 4, 8, os.cpu_count()]:
+            positions, t = _timed(M.search_file, fp.name, jobs, 1 << 22)
+            assert expected in (None, positions)
+            expected = positions
+            print("%4s jobs %8.3f s %8s matches" % (jobs, t, len(positions)))
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name in sys.argv[1:]:
+        globals()["_benchmark_" + name]()
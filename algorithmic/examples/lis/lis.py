@@ -1,3 +1,16 @@
+import os
+import time
+import array
+import random
+import bisect
+import contextlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 GLOBALS = "inf".split()
 PATTERNS = [
     ("inf", r"\infty"),
@@ -73,3 +86,195 @@ def lis(x):
             n = n - 1
     for i in range(len(result)):
         print(result[i])
+
+
+def _lis_bisect(x, strict=True, key=None, indices=False):
+    """
+    Return a longest increasing subsequence of x as a list, or the list of
+    its indices in x if `indices` is true. If `strict` is false, equal
+    consecutive elements are allowed, as in lis. If `key` is given, the
+    elements are compared by key(element).
+    Uses the C implementation of binary search in bisect, and stores the
+    predecessor of each element in an array of machine integers.
+
+    >>> x = [9, 44, 32, 12, 7, 42, 34, 92, 35, 37, 41, 8, 20, 27, 83, 64, 61,
+    ...      28, 39, 93, 29, 17, 13, 14, 55, 21, 66, 72, 23, 73, 99, 1, 2, 88,
+    ...      77, 3, 65, 83, 84, 62, 5, 11, 74, 68, 76, 78, 67, 75, 69, 70, 22]
+    >>> _lis_bisect(x, strict=False)
+    [7, 8, 20, 27, 28, 29, 55, 66, 72, 73, 74, 76, 78]
+    >>> _lis_bisect([3, 1, 2, 2, 5, 4])
+    [1, 2, 4]
+    >>> _lis_bisect([3, 1, 2, 2, 5, 4], strict=False, indices=True)
+    [1, 2, 3, 5]
+    >>> _lis_bisect(["b", "A", "c", "B"], key=str.lower)
+    ['A', 'B']
+    >>> _lis_bisect([])
+    []
+    """
+    if key is not None:
+        x_keys = list(map(key, x))
+    else:
+        x_keys = x
+    search = bisect.bisect_left if strict else bisect.bisect_right
+    # tails[j] is the smallest key that ends an increasing subsequence of
+    # length j + 1 among the elements seen so far, and tail_index[j] is
+    # the index of the element with that key.
+    tails = []
+    tail_index = array.array("l")
+    prev = array.array("l", [-1]) * len(x_keys)
+    for i, v in enumerate(x_keys):
+        j = search(tails, v)
+        if j == len(tails):
+            tails.append(v)
+            tail_index.append(i)
+        else:
+            tails[j] = v
+            tail_index[j] = i
+        if j > 0:
+            prev[i] = tail_index[j - 1]
+    result = []
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        result.append(i)
+        i = prev[i]
+    result.reverse()
+    if indices:
+        return result
+    return [x[i] for i in result]
+
+
+def _lis_lengths(X, lengths=None, strict=True):
+    """
+    Return the length of a longest increasing subsequence of each row of
+    the 2-D NumPy array X, where only the first lengths[r] elements of row
+    r are used (all of them if `lengths` is None). X may also be a list of
+    sequences of different lengths, which is padded first; `lengths` then
+    further shortens the rows.
+    The patience sort update runs for all rows at once, one column at a
+    time, so the time is O(m k l) NumPy work for m rows of length k with
+    longest increasing subsequences of length at most l.
+    Without NumPy, falls back to _lis_bisect on each row.
+
+    >>> _lis_lengths([[3, 1, 2, 2, 5, 4], [], [1], [5, 4, 3], [1, 2, 3]])
+    [3, 0, 1, 1, 3]
+    >>> _lis_lengths([[3, 1, 2, 2, 5, 4], [2, 2]], strict=False)
+    [4, 2]
+    >>> _lis_lengths([[1.2, 1.5], [0.1, 0.9, 0.5]])
+    [2, 2]
+    >>> _lis_lengths([[3, 1, 2, 5], [1, 2, 3]], lengths=[2, 5])
+    [1, 3]
+    >>> top = 9223372036854775807  # the largest 64-bit integer
+    >>> _lis_lengths([[1, top], [top, top]], strict=False)
+    [2, 2]
+    >>> rng = random.Random(0)
+    >>> rows = [[rng.randrange(10) for i in range(rng.randrange(20))]
+    ...         for r in range(100)]
+    >>> _lis_lengths(rows) == [len(_lis_bisect(x)) for x in rows]
+    True
+    """
+    if numpy is None:
+        if lengths is not None:
+            X = [x[:n] for x, n in zip(X, lengths)]
+        return [len(_lis_bisect(list(x), strict)) for x in X]
+    if not isinstance(X, numpy.ndarray):
+        X, row_lengths = _pad(X)
+        if lengths is None:
+            lengths = row_lengths
+        else:
+            lengths = numpy.minimum(lengths, row_lengths)
+    m, k = X.shape
+    if lengths is None:
+        lengths = numpy.full(m, k)
+    lengths = numpy.asarray(lengths)
+    # Sort the rows by decreasing length, so that the rows that are still
+    # active in column t are a prefix and can be sliced without copying.
+    order = numpy.argsort(-lengths, kind="stable")
+    X = X[order]
+    # active[t] is the number of rows with more than t elements
+    active = numpy.searchsorted(-lengths[order], -numpy.arange(k), "left")
+    # tails[r, j] for j < size[r] is the smallest element that ends an
+    # increasing subsequence of length j + 1 in the part of row r seen so
+    # far. The other entries are unused, so no sentinel value is needed.
+    tails = numpy.zeros((m, k), dtype=X.dtype)
+    size = numpy.zeros(m, dtype=numpy.intp)
+    width = 0
+    for t in range(k):
+        a = active[t]
+        if a == 0:
+            break
+        v = X[:a, t]
+        used = numpy.arange(width) < size[:a, None]
+        if strict:
+            j = ((tails[:a, :width] < v[:, None]) & used).sum(axis=1)
+        else:
+            j = ((tails[:a, :width] <= v[:, None]) & used).sum(axis=1)
+        tails[numpy.arange(a), j] = v
+        numpy.maximum(size[:a], j + 1, out=size[:a])
+        width = max(width, int(j.max()) + 1)
+    result = numpy.empty(m, dtype=numpy.intp)
+    result[order] = size
+    return result.tolist()
+
+
+def _pad(sequences):
+    """
+    Return the list of sequences as a 2-D array padded with zeros, of
+    the common type of their elements, together with their lengths.
+    """
+    lengths = numpy.array([len(x) for x in sequences], dtype=numpy.intp)
+    k = int(lengths.max()) if len(sequences) else 0
+    values = numpy.array([v for x in sequences for v in x])
+    if len(values) == 0:
+        values = values.astype(numpy.int64)
+    X = numpy.zeros((len(sequences), k), dtype=values.dtype)
+    X[numpy.arange(k) < lengths[:, None]] = values
+    return X, lengths
+
+
+def _timed(f, *args):
+    t = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - t
+
+
+def _benchmark_bisect():
+    """
+    Time lis, with its output discarded, and _lis_bisect on random
+    sequences of growing length.
+    """
+    rng = random.Random(0)
+    print("%10s %10s %12s" % ("n", "lis", "_lis_bisect"))
+    for n in [10000, 100000, 1000000, 10000000]:
+        x = [rng.randrange(n) for i in range(n)]
+        t1 = "-"
+        if n <= 1000000:
+            with open(os.devnull, "w") as fp, contextlib.redirect_stdout(fp):
+                _, t1 = _timed(lis, x)
+            t1 = "%.3f" % t1
+        result, t2 = _timed(_lis_bisect, x, False)
+        print("%10s %10s %12.3f" % (n, t1, t2))
+
+
+def _benchmark_batch():
+    """
+    Compute LIS lengths of 10^5 random sequences of length up to k with
+    _lis_lengths and with _lis_bisect per sequence.
+    """
+    rng = numpy.random.default_rng(0)
+    m = 100000
+    print("%6s %12s %12s" % ("k", "_lis_bisect", "_lis_lengths"))
+    for k in [8, 16, 32, 64]:
+        X = rng.integers(0, 1000, size=(m, k))
+        lengths = rng.integers(0, k + 1, size=m)
+        rows = [x[:n].tolist() for x, n in zip(X, lengths)]
+        r1, t1 = _timed(lambda: [len(_lis_bisect(x)) for x in rows])
+        r2, t2 = _timed(_lis_lengths, X, lengths)
+        assert r1 == r2
+        print("%6s %12.3f %12.3f" % (k, t1, t2))
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name in sys.argv[1:]:
+        globals()["_benchmark_" + name]()
@@ -1,13 +1,28 @@
+import os
+import time
+import array
+import pickle
+import random
 import itertools
+import collections
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-GLOBALS = "Set".split()
+
+GLOBALS = "Set collections".split()
 PATTERNS = [
     ("Set()", r"\emptyset "),
     ("Set(a)", r"\{#a\}"),
     ("Set(a, b)", r"\{#a, #b\}"),
     ("a[0:1] = []", r"\STATE remove first element of $#a$"),
     ("a.extend(b)", r"\text{insert $#b$ at the end of $#a$}"),
+    ("collections.deque(a)", "#a"),
+    ("x = a.popleft()", r"\STATE $#x \gets$ remove first element of $#a$"),
+    ("a is not None", r"#a \ne \textsc{nil}"),
+    ('"".join(reversed(a))', r"\text{the elements of $#a$ in reverse order}"),
     ("True", r"\top "),
     ("False", r"\bot "),
     ("(a and b) or (c and d)", r"(#a \land #b) \lor (#c \land #d)"),
@@ -29,11 +44,10 @@ def reachable_states(Q, Sigma, q0, delta):
     >>> sorted(delta_prime.keys())
     [(1, 'a'), (2, 'a')]
     """
-    next = [q0]
+    next = collections.deque([q0])
     Q_prime = {q0}
     while len(next) > 0:
-        p = next[0]
-        next[0:1] = []
+        p = next.popleft()
         for sigma in Sigma:
             q = delta[p, sigma]
             if q not in Q_prime:
@@ -117,6 +131,103 @@ def minimize(Q, Sigma, q0, delta, A):
     return Q_prime, Sigma, q0_prime, delta_prime, A_prime
 
 
+def _minimize_hopcroft(Q, Sigma, q0, delta, A):
+    """
+    Same as minimize, but using Hopcroft's partition refinement,
+    which takes O(|Q| |Sigma| log |Q|) time.
+
+    >>> Q = {1, 2, 3, 4, 5}
+    >>> Sigma = {'a', 'b'}
+    >>> q0 = 1
+    >>> delta = {
+    ...     (1, 'a'): 2,
+    ...     (1, 'b'): 3,
+    ...     (2, 'a'): 1,
+    ...     (2, 'b'): 2,
+    ...     (3, 'a'): 4,
+    ...     (3, 'b'): 3,
+    ...     (4, 'a'): 3,
+    ...     (4, 'b'): 4,
+    ...     (5, 'a'): 5,
+    ...     (5, 'b'): 5,
+    ... }
+    >>> A = {3, 4}
+    >>> _print_machine(_minimize_hopcroft(Q, Sigma, q0, delta, A))
+    I  1 a-> 2 b-> 3
+       2 a-> 1 b-> 2
+     A 3 a-> 3 b-> 3
+    """
+    Q, delta = reachable_states(Q, Sigma, q0, delta)
+    predecessors = {}
+    for p in Q:
+        for sigma in Sigma:
+            predecessors.setdefault((delta[p, sigma], sigma), []).append(p)
+    accepting = set()
+    rejecting = set()
+    for q in Q:
+        if q in A:
+            accepting.add(q)
+        else:
+            rejecting.add(q)
+    blocks = []
+    block = {}
+    for B in [accepting, rejecting]:
+        if len(B) > 0:
+            for q in B:
+                block[q] = len(blocks)
+            blocks.append(B)
+    waiting = []
+    is_waiting = set()
+    if len(blocks) == 2:
+        for sigma in Sigma:
+            if len(blocks[0]) <= len(blocks[1]):
+                waiting.append((0, sigma))
+                is_waiting.add((0, sigma))
+            else:
+                waiting.append((1, sigma))
+                is_waiting.add((1, sigma))
+    while len(waiting) > 0:
+        splitter = waiting.pop()
+        is_waiting.remove(splitter)
+        b, sigma = splitter
+        # Group the states with a sigma-transition into block b
+        # by the block they are in.
+        incoming = {}
+        for q in blocks[b]:
+            for p in predecessors.get((q, sigma), []):
+                incoming.setdefault(block[p], set()).add(p)
+        for c in incoming:
+            if len(incoming[c]) < len(blocks[c]):
+                # Split block c into incoming[c] and the rest
+                blocks[c] -= incoming[c]
+                d = len(blocks)
+                blocks.append(incoming[c])
+                for p in incoming[c]:
+                    block[p] = d
+                for tau in Sigma:
+                    if (c, tau) in is_waiting or len(blocks[d]) <= len(blocks[c]):
+                        waiting.append((d, tau))
+                        is_waiting.add((d, tau))
+                    else:
+                        waiting.append((c, tau))
+                        is_waiting.add((c, tau))
+    rep = {}
+    for q in Q:
+        if block[q] not in rep:
+            rep[block[q]] = q
+    Q_prime = set()
+    A_prime = set()
+    for p in rep.values():
+        Q_prime.add(p)
+        if p in A:
+            A_prime.add(p)
+    delta_prime = {}
+    for p in Q_prime:
+        for sigma in Sigma:
+            delta_prime[p, sigma] = rep[block[delta[p, sigma]]]
+    return Q_prime, Sigma, rep[block[q0]], delta_prime, A_prime
+
+
 def union(Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2):
     """
     >>> Sigma = {'a', 'b'}
@@ -183,6 +294,44 @@ def symmetric_difference(Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2):
     return Q, Sigma, q0, delta, A
 
 
+def counterexample(Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2):
+    """
+    Return a shortest string accepted by exactly one of the two DFAs, or
+    None if they are equivalent. Only the pairs of states reachable in the
+    product are visited, and the search stops at the first pair that
+    disagrees. A missing transition leads to a rejecting dead state.
+
+    >>> def check(r1, r2):
+    ...     Q1, Sigma1, q1, delta1, A1 = _regex_fa(r1)
+    ...     Q2, Sigma2, q2, delta2, A2 = _regex_fa(r2)
+    ...     Sigma = set(Sigma1) | set(Sigma2)
+    ...     return counterexample(Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2)
+    >>> check("(a|b*)*", "(a|b)*")
+    >>> check("(a|b)*", "(a|b)*ab")
+    ''
+    >>> check("(a|b)*ab", "a*b")
+    'b'
+    >>> check("(a|b)*ab", "(a|b)*bab")
+    'ab'
+    >>> check("ab*", "abbb")
+    'a'
+    """
+    q0 = (q1, q2)
+    parent = {}
+    parent[q0] = None
+    queue = collections.deque([q0])
+    while len(queue) > 0:
+        p, q = queue.popleft()
+        if (p in A1 and q not in A2) or (p not in A1 and q in A2):
+            return path_to(parent, (p, q))
+        for sigma in Sigma:
+            r = (delta1.get((p, sigma)), delta2.get((q, sigma)))
+            if r not in parent:
+                parent[r] = ((p, q), sigma)
+                queue.append(r)
+    return None
+
+
 def shortest_paths(Q, Sigma, q0, delta, A):
     """
     >>> Q = {1, 2, 3, 4}
@@ -202,29 +351,79 @@ def shortest_paths(Q, Sigma, q0, delta, A):
     >>> shortest_paths(Q, Sigma, q0, delta, A)
     {1: '', 2: 'a', 3: 'b', 4: 'ba'}
     """
+    parent = shortest_path_tree(Q, Sigma, q0, delta)
     paths = {}
-    paths[q0] = ""
-    queue = [q0]
+    for q in parent:
+        paths[q] = path_to(parent, q)
+    return paths
+
+
+def shortest_path_tree(Q, Sigma, q0, delta):
+    """
+    Return a dict mapping each state reachable from q0 to None for q0 and
+    to (p, sigma) otherwise, where p is the previous state on a shortest
+    path and sigma is the symbol leading from p.
+    Use path_to to get the path to a particular state.
+
+    >>> delta = {(1, 'a'): 2, (2, 'a'): 3, (3, 'a'): 1, (4, 'a'): 1}
+    >>> parent = shortest_path_tree({1, 2, 3, 4}, {'a'}, 1, delta)
+    >>> parent
+    {1: None, 2: (1, 'a'), 3: (2, 'a')}
+    >>> path_to(parent, 3)
+    'aa'
+    """
+    parent = {}
+    parent[q0] = None
+    queue = collections.deque([q0])
     while len(queue) > 0:
-        p = queue[0]
-        queue[0:1] = []
+        p = queue.popleft()
         for sigma in Sigma:
             q = delta[p, sigma]
-            if q not in paths:
-                paths[q] = paths[p] + sigma
+            if q not in parent:
+                parent[q] = (p, sigma)
                 queue.append(q)
-    return paths
+    return parent
+
+
+def path_to(parent, q):
+    """
+    Follow the (state, symbol) pointers in `parent` back from `q` to the
+    state whose parent is None, and return the symbols along the way.
+    """
+    symbols = []
+    while parent[q] is not None:
+        q, sigma = parent[q]
+        symbols.append(sigma)
+    return "".join(reversed(symbols))
 
 
 def shortest_accepted(Q, Sigma, q0, delta, A):
-    paths = shortest_paths(Q, Sigma, q0, delta, A)
-    x = None
-    n = float("inf")
-    for q in A:
-        if len(paths[q]) < n:
-            x = paths[q]
-            n = len(paths[q])
-    return x
+    """
+    Return a shortest string accepted by the DFA, or None if it accepts
+    nothing. The search stops at the first accepting state it reaches.
+
+    >>> delta = {(1, 'a'): 2, (1, 'b'): 1, (2, 'a'): 3, (2, 'b'): 1,
+    ...          (3, 'a'): 3, (3, 'b'): 3, (4, 'a'): 4, (4, 'b'): 4}
+    >>> shortest_accepted({1, 2, 3, 4}, ['a', 'b'], 1, delta, {3})
+    'aa'
+    >>> shortest_accepted({1, 2, 3, 4}, ['a', 'b'], 1, delta, {1})
+    ''
+    >>> print(shortest_accepted({1, 2, 3, 4}, ['a', 'b'], 1, delta, {4}))
+    None
+    """
+    parent = {}
+    parent[q0] = None
+    queue = collections.deque([q0])
+    while len(queue) > 0:
+        p = queue.popleft()
+        if p in A:
+            return path_to(parent, p)
+        for sigma in Sigma:
+            q = delta[p, sigma]
+            if q not in parent:
+                parent[q] = (p, sigma)
+                queue.append(q)
+    return None
 
 
 def Set(*args):
@@ -269,6 +468,8 @@ def _parse(s, empty, c, all, any, rep):
     {'': ['a', 'b']}
     >>> p("(a|)*")
     {'': ('a', '')}
+    >>> p("a(b|c)")
+    ['a', ('b', 'c')]
     """
     i = 0
 
@@ -314,7 +515,7 @@ def _parse(s, empty, c, all, any, rep):
 
     def term():
         r = [factor()]
-        while peek_char():
+        while peek_char() or peek() == "(":
             r.append(factor())
         return r[0] if len(r) == 1 else all(r)
 
@@ -430,6 +631,104 @@ def lambda_elimination(Q, Sigma, q0, delta, A):
     return Q, Sigma, q0, delta_prime, A_prime
 
 
+def _lambda_closures(Q, delta):
+    """
+    Return a dict mapping each state to the frozenset of states reachable
+    from it by lambda-transitions, computed for all states in one pass.
+    The states of a strongly connected component of the lambda-transitions
+    share their closure, and since Tarjan's algorithm finds the components
+    in reverse topological order, the closure of a component is the union
+    of the component and the closures of its successors.
+
+    >>> Q, Sigma, q0, delta, A = _parse_nfa("(a*|b)")
+    >>> closures = _lambda_closures(Q, delta)
+    >>> [sorted(closures[q]) for q in Q]
+    [[0], [0, 1, 2, 3, 4], [0, 2, 3], [3], [4]]
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    closures = {}
+    for root in Q:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(delta.get((root, ""), ())))]
+        while work:
+            v, successors = work[-1]
+            for w in successors:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(delta.get((w, ""), ()))))
+                    break
+                elif w in on_stack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.remove(w)
+                        component.append(w)
+                        if w == v:
+                            break
+                    closure = set(component)
+                    for w in component:
+                        for x in delta.get((w, ""), ()):
+                            if x in closures:
+                                closure |= closures[x]
+                    closure = frozenset(closure)
+                    for w in component:
+                        closures[w] = closure
+    return closures
+
+
+def _lambda_elimination_scc(Q, Sigma, q0, delta, A):
+    """
+    Same as lambda_elimination, but with the closures computed by
+    _lambda_closures and with duplicate-free sets of successors.
+
+    >>> M = _parse_nfa("(a|b*|a*)*")
+    >>> M1 = lambda_elimination(*M)
+    >>> M2 = _lambda_elimination_scc(*M)
+    >>> M1[4] == M2[4]
+    True
+    >>> all(set(M1[3][k]) == M2[3][k] for k in M1[3])
+    True
+    >>> M = _parse_nfa("(a|a|a)*")
+    >>> _size(lambda_elimination(*M)), _size(_lambda_elimination_scc(*M))
+    (9, 5)
+    """
+    closures = _lambda_closures(Q, delta)
+    rows = {}
+    delta_prime = {}
+    A_prime = set()
+    for p in Q:
+        closure = closures[p]
+        if closure not in rows:
+            row = {}
+            for sigma in Sigma:
+                targets = set()
+                for q in closure:
+                    targets.update(delta.get((q, sigma), ()))
+                row[sigma] = frozenset(targets)
+            rows[closure] = row
+        for sigma in Sigma:
+            delta_prime[p, sigma] = rows[closure][sigma]
+        if not A.isdisjoint(closure):
+            A_prime.add(p)
+    return Q, Sigma, q0, delta_prime, A_prime
+
+
 def determinize(Q, Sigma, q0, delta, A):
     Q_prime = {Set(q0)}
     delta_prime = {}
@@ -455,6 +754,63 @@ def determinize(Q, Sigma, q0, delta, A):
     return Q_prime, Sigma, Set(q0), delta_prime, A_prime
 
 
+def _determinize_bitset(Q, Sigma, q0, delta, A):
+    """
+    Same as determinize, but with each set of NFA states represented by
+    an int in which bit i is set if the i'th state of Q is in the set.
+    The states of the returned DFA are these ints.
+
+    >>> M = lambda_elimination(*_parse_nfa("(a|b)b*c"))
+    >>> M1 = determinize(*M)
+    >>> M2 = _determinize_bitset(*M)
+    >>> len(M1[0]), len(M2[0])
+    (4, 4)
+    >>> xs = ["", "ac", "bbc", "abbbbc", "cc", "abcb"]
+    >>> [matches(*M1, x) for x in xs] == [matches(*M2, x) for x in xs]
+    True
+    """
+    index = {q: i for i, q in enumerate(Q)}
+    symbols = list(Sigma)
+    # successors[i][j] is the set of states reached from the i'th state
+    # of Q on the j'th symbol.
+    successors = []
+    for q in Q:
+        row = []
+        for sigma in symbols:
+            m = 0
+            for r in delta[q, sigma]:
+                m |= 1 << index[r]
+            row.append(m)
+        successors.append(row)
+    accepting = 0
+    for q in A:
+        if q in index:
+            accepting |= 1 << index[q]
+
+    start = 1 << index[q0]
+    Q_prime = {start}
+    delta_prime = {}
+    queue = collections.deque([start])
+    while queue:
+        p = queue.popleft()
+        targets = [0] * len(symbols)
+        m = p
+        while m:
+            low = m & -m
+            row = successors[low.bit_length() - 1]
+            for j in range(len(symbols)):
+                targets[j] |= row[j]
+            m ^= low
+        for sigma, r in zip(symbols, targets):
+            delta_prime[p, sigma] = r
+            if r not in Q_prime:
+                Q_prime.add(r)
+                queue.append(r)
+
+    A_prime = {p for p in Q_prime if p & accepting}
+    return Q_prime, Sigma, start, delta_prime, A_prime
+
+
 def rename(Q, Sigma, q0, delta, A):
     names = {}
     Q_prime = set()
@@ -473,20 +829,34 @@ def rename(Q, Sigma, q0, delta, A):
     return Q_prime, Sigma, names[q0], delta_prime, A_prime
 
 
-def _regex_fa(s):
+def _regex_fa(s, timings=None):
     """
+    If `timings` is a dict, the time in seconds spent in each stage is
+    stored in it.
+
     >>> _print_machine(_regex_fa("(a|b)b*c"))
        1 a-> 1 b-> 1 c-> 1
     I  2 a-> 3 b-> 3 c-> 1
        3 a-> 1 b-> 3 c-> 4
      A 4 a-> 1 b-> 1 c-> 1
+    >>> timings = {}
+    >>> M = _regex_fa("(a|b)b*c", timings)
+    >>> list(timings)
+    ['parse', 'lambda_elimination', 'determinize', 'rename', 'minimize']
     """
-    Q, Sigma, q0, delta, A = _parse_nfa(s)
-    Q, Sigma, q0, delta, A = lambda_elimination(Q, Sigma, q0, delta, A)
-    Q, Sigma, q0, delta, A = determinize(Q, Sigma, q0, delta, A)
-    Q, Sigma, q0, delta, A = rename(Q, Sigma, q0, delta, A)
-    Q, Sigma, q0, delta, A = minimize(Q, Sigma, q0, delta, A)
-    return Q, Sigma, q0, delta, A
+    M = _stage(timings, "parse", _parse_nfa, s)
+    M = _stage(timings, "lambda_elimination", _lambda_elimination_scc, *M)
+    M = _stage(timings, "determinize", determinize, *M)
+    M = _stage(timings, "rename", rename, *M)
+    M = _stage(timings, "minimize", minimize, *M)
+    return M
+
+
+def _stage(timings, name, f, *args):
+    if timings is None:
+        return f(*args)
+    result, timings[name] = _timed(f, *args)
+    return result
 
 
 def matches(Q, Sigma, q0, delta, A, x):
@@ -517,19 +887,447 @@ def matches(Q, Sigma, q0, delta, A, x):
     return q in A
 
 
+class ArrayDFA:
+    """
+    Compact DFA with states numbered 0, ..., n-1 (the start state is 0)
+    and symbols numbered by their position in the sorted alphabet.
+    The transition table is stored row by row in an array of C ints,
+    so delta(q, symbols[j]) is table[q * len(symbols) + j],
+    and accepting[q] is 1 if q is an accepting state.
+
+    >>> M = ArrayDFA.from_tuple(_regex_fa("(a|b)b*c"))
+    >>> M.symbols, len(M)
+    (['a', 'b', 'c'], 4)
+    >>> [M.matches(x) for x in ["", "ac", "bbc", "abbbbc", "cc"]]
+    [False, True, True, True, False]
+    >>> _print_machine(ArrayDFA.from_tuple(_regex_fa("ab|b")).to_tuple())
+    I  0 a-> 2 b-> 3
+       1 a-> 1 b-> 1
+       2 a-> 1 b-> 3
+     A 3 a-> 1 b-> 1
+    """
+
+    __slots__ = ("symbols", "column", "table", "accepting", "names")
+
+    def __init__(self, symbols, table, accepting, names=None):
+        self.symbols = symbols
+        self.column = {sigma: j for j, sigma in enumerate(symbols)}
+        self.table = table
+        self.accepting = accepting
+        self.names = names
+
+    def __len__(self):
+        return len(self.accepting)
+
+    @classmethod
+    def from_tuple(cls, M):
+        """
+        Convert from the (Q, Sigma, q0, delta, A) representation.
+        The original state names are kept in `names`.
+        """
+        Q, Sigma, q0, delta, A = M
+        names = [q0] + [q for q in Q if q != q0]
+        number = {q: i for i, q in enumerate(names)}
+        symbols = sorted(Sigma)
+        table = array.array("i", [0]) * (len(names) * len(symbols))
+        i = 0
+        for q in names:
+            for sigma in symbols:
+                table[i] = number[delta[q, sigma]]
+                i += 1
+        accepting = bytearray(1 if q in A else 0 for q in names)
+        return cls(symbols, table, accepting, names)
+
+    def to_tuple(self, names=False):
+        """
+        Convert to the (Q, Sigma, q0, delta, A) representation, with
+        states 0, ..., n-1 or with the original names if `names` is true.
+        """
+        k = len(self.symbols)
+        if names:
+            name = self.names
+        else:
+            name = range(len(self))
+        Q = set(name)
+        A = {name[q] for q in range(len(self)) if self.accepting[q]}
+        delta = {
+            (name[q], sigma): name[self.table[q * k + j]]
+            for q in range(len(self))
+            for j, sigma in enumerate(self.symbols)
+        }
+        return Q, set(self.symbols), name[0], delta, A
+
+    def step(self, q, sigma):
+        return self.table[q * len(self.symbols) + self.column[sigma]]
+
+    def run(self, x, q=0):
+        """
+        Return the state reached from `q` on reading the string `x`.
+        """
+        table = self.table
+        column = self.column
+        k = len(self.symbols)
+        for c in x:
+            q = table[q * k + column[c]]
+        return q
+
+    def matches(self, x):
+        return self.accepting[self.run(x)] == 1
+
+    def matches_chunks(self, chunks):
+        """
+        Return True if the concatenation of the strings in the iterable
+        `chunks` is accepted, without concatenating them.
+
+        >>> M = ArrayDFA.from_tuple(_regex_fa("(a|b)b*c"))
+        >>> M.matches_chunks(iter(["ab", "", "bbb", "c"]))
+        True
+        """
+        q = 0
+        for chunk in chunks:
+            q = self.run(chunk, q)
+        return self.accepting[q] == 1
+
+    def matches_many(self, strings):
+        """
+        Return a list of booleans saying which of `strings` are accepted.
+        With NumPy, all strings are advanced through the transition table
+        in lockstep, one character position at a time.
+
+        >>> M = ArrayDFA.from_tuple(_regex_fa("(a|b)b*c"))
+        >>> M.matches_many(["", "ac", "bbc", "abbbbc", "cc", "bbbbbc"])
+        [False, True, True, True, False, True]
+        >>> M.matches_many(["acx"])
+        Traceback (most recent call last):
+        ...
+        KeyError: 'x'
+        >>> ArrayDFA.from_tuple(_regex_fa("")).matches_many(["", ""])
+        [True, True]
+        """
+        if numpy is None or not all(len(c) == 1 for c in self.symbols):
+            return [self.matches(x) for x in strings]
+        return self.matches_encoded(self.encode(strings)).tolist()
+
+    def matches_stream(self, strings, batch_size=65536):
+        """
+        Yield for each string in the iterable `strings` whether it is
+        accepted, processing `batch_size` strings at a time.
+
+        >>> M = ArrayDFA.from_tuple(_regex_fa("a*|b"))
+        >>> list(M.matches_stream(("a" * i + "b" * (i % 3 == 0)
+        ...                        for i in range(1, 8)), batch_size=3))
+        [True, True, False, True, True, False, True]
+        """
+        batch = []
+        for x in strings:
+            batch.append(x)
+            if len(batch) == batch_size:
+                yield from self.matches_many(batch)
+                batch = []
+        yield from self.matches_many(batch)
+
+    def encode(self, strings):
+        """
+        Encode a list of strings as a 2-D NumPy array of symbol numbers,
+        one row per string, padded with len(self.symbols).
+        Requires NumPy and an alphabet of single characters.
+
+        >>> M = ArrayDFA.from_tuple(_regex_fa("(a|b)b*c"))
+        >>> M.encode(["ac", "", "bbc"]).tolist()
+        [[0, 2, 3], [3, 3, 3], [1, 1, 2]]
+        """
+        k = len(self.symbols)
+        lengths = numpy.fromiter(map(len, strings), numpy.intp, len(strings))
+        width = int(lengths.max()) if len(strings) > 0 else 0
+        text = "".join(strings).encode("utf-32-le")
+        codepoints = numpy.frombuffer(text, dtype=numpy.uint32)
+        # An empty alphabet still needs one entry for the clamped lookups
+        size = max((ord(c) for c in self.symbols), default=-1) + 2
+        lookup = numpy.full(size, -1, dtype=numpy.intc)
+        for j, c in enumerate(self.symbols):
+            lookup[ord(c)] = j
+        flat = lookup[numpy.minimum(codepoints, len(lookup) - 1)]
+        if (flat < 0).any():
+            bad = codepoints[numpy.argmax(flat < 0)]
+            raise KeyError(chr(bad))
+        codes = numpy.full((len(strings), width), k, dtype=numpy.intc)
+        codes[numpy.arange(width) < lengths[:, None]] = flat
+        return codes
+
+    def matches_encoded(self, codes):
+        """
+        Return a NumPy array of booleans saying which rows of `codes`
+        (as returned by encode) are accepted.
+        """
+        n = len(self)
+        k = len(self.symbols)
+        # Add a column for the padding symbol that stays in the same state
+        table = numpy.frombuffer(self.table, dtype=numpy.intc).reshape(n, k)
+        stay = numpy.arange(n, dtype=numpy.intc)[:, None]
+        table = numpy.hstack([table, stay]).ravel()
+        q = numpy.zeros(len(codes), dtype=numpy.intp)
+        for column in numpy.ascontiguousarray(codes.T):
+            q = table[q * (k + 1) + column]
+        accepting = numpy.frombuffer(bytes(self.accepting), dtype=numpy.uint8)
+        return accepting[q] == 1
+
+    def reachable(self):
+        """
+        Return the DFA restricted to the states reachable from the start,
+        renumbered in breadth-first order.
+        """
+        k = len(self.symbols)
+        number = {0: 0}
+        order = [0]
+        queue = collections.deque(order)
+        while queue:
+            p = queue.popleft()
+            for j in range(k):
+                q = self.table[p * k + j]
+                if q not in number:
+                    number[q] = len(order)
+                    order.append(q)
+                    queue.append(q)
+        table = array.array("i", [0]) * (len(order) * k)
+        for i, p in enumerate(order):
+            for j in range(k):
+                table[i * k + j] = number[self.table[p * k + j]]
+        accepting = bytearray(self.accepting[p] for p in order)
+        names = None if self.names is None else [self.names[p] for p in order]
+        return ArrayDFA(list(self.symbols), table, accepting, names)
+
+    def product(self, other, accept):
+        """
+        Return the product automaton of the pairs of states reachable
+        from the pair of start states, where a pair (p, q) is accepting
+        if accept(p is accepting, q is accepting) is true.
+        Both automata must have the same alphabet.
+
+        >>> M1 = ArrayDFA.from_tuple(_regex_fa("a*"))
+        >>> M2 = ArrayDFA.from_tuple(_regex_fa("(a|b)*"))
+        >>> M1.symbols, M2.symbols
+        (['a'], ['a', 'b'])
+        >>> M1.product(M2, lambda a, b: a and b)
+        Traceback (most recent call last):
+        ...
+        ValueError: Alphabets differ: ['a'] and ['a', 'b']
+        >>> M1 = ArrayDFA.from_tuple(_regex_fa("(a|b)*a"))
+        >>> M = M1.product(M2, lambda a, b: a != b)
+        >>> len(M), M.matches("ab"), M.matches("ba")
+        (2, True, False)
+        >>> M.names
+        [(0, 0), (1, 0)]
+        """
+        if self.symbols != other.symbols:
+            raise ValueError(
+                "Alphabets differ: %r and %r" % (self.symbols, other.symbols)
+            )
+        k = len(self.symbols)
+        number = {(0, 0): 0}
+        order = [(0, 0)]
+        table = array.array("i")
+        accepting = bytearray()
+        i = 0
+        while i < len(order):
+            p, q = order[i]
+            i += 1
+            accepting.append(1 if accept(self.accepting[p], other.accepting[q]) else 0)
+            for j in range(k):
+                r = (self.table[p * k + j], other.table[q * k + j])
+                if r not in number:
+                    number[r] = len(order)
+                    order.append(r)
+                table.append(number[r])
+        return ArrayDFA(list(self.symbols), table, accepting, order)
+
+
+class LazyDFA:
+    """
+    Matcher for the regular expression `s` that simulates the NFA from
+    _parse_nfa, caching the sets of NFA states it visits as DFA states.
+    At most `cache_size` DFA states are kept, evicting the least recently
+    used one. If states are evicted faster than one per `min_progress`
+    characters of input, the cache is not helping and matches() falls back
+    to plain NFA simulation for the rest of the input.
+
+    >>> M = LazyDFA("(a|b)b*c")
+    >>> [M.matches(x) for x in ["", "a", "ac", "bc", "cc", "abbbbc", "bbbbbc"]]
+    [False, False, True, True, False, True, True]
+    >>> M.matches("abx")
+    False
+    >>> M = LazyDFA("(a|b)*a(a|b)(a|b)(a|b)", cache_size=4)
+    >>> x = "abbabaabbbaaabab" * 10
+    >>> M.matches(x), M.matches(x + "abb"), M.fallbacks
+    (True, False, 2)
+    >>> len(M.cache)
+    4
+    """
+
+    def __init__(self, s, cache_size=1024, min_progress=10):
+        Q, Sigma, q0, delta, A = _parse_nfa(s)
+        self.delta = delta
+        self.accepting = frozenset(A)
+        self.closures = _lambda_closures(Q, delta)
+        self.start = self.closures[q0]
+        self.cache_size = cache_size
+        self.min_progress = min_progress
+        # Maps a DFA state to a dict from symbols to DFA states
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fallbacks = 0
+
+    def successor(self, S, c):
+        """
+        Return the set of NFA states reached from the set S on symbol c.
+        """
+        T = set()
+        for q in S:
+            for r in self.delta.get((q, c), ()):
+                T |= self.closures[r]
+        return frozenset(T)
+
+    def step(self, S, c):
+        cache = self.cache
+        try:
+            row = cache[S]
+        except KeyError:
+            row = cache[S] = {}
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+                self.evictions += 1
+        else:
+            cache.move_to_end(S)
+        try:
+            T = row[c]
+        except KeyError:
+            self.misses += 1
+            T = row[c] = self.successor(S, c)
+        else:
+            self.hits += 1
+        return T
+
+    def matches(self, x):
+        S = self.start
+        evictions = self.evictions
+        for i, c in enumerate(x):
+            S = self.step(S, c)
+            thrashing = self.evictions - evictions
+            if thrashing > self.cache_size and thrashing * self.min_progress > i:
+                self.fallbacks += 1
+                for c in x[i + 1 :]:
+                    S = self.successor(S, c)
+                break
+        return not self.accepting.isdisjoint(S)
+
+
+class RegexCache:
+    """
+    Least recently used cache of the minimal DFAs built by _regex_fa,
+    keyed by the text of the regular expression. At most `maxsize`
+    automata are kept. If `path` is given, the cache is loaded from that
+    pickle file if it exists, and save() writes it back.
+    The returned automata are shared between callers and must not be
+    modified.
+
+    >>> cache = RegexCache(maxsize=2)
+    >>> M = cache.get("(a|b)*")
+    >>> cache.get("(a|b)*") is M
+    True
+    >>> _ = cache.get("a"), cache.get("b")
+    >>> cache.hits, cache.misses, "(a|b)*" in cache
+    (1, 3, False)
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     cache.path = os.path.join(d, "regex.pickle")
+    ...     cache.save()
+    ...     cache = RegexCache(path=cache.path)
+    ...     len(RegexCache(maxsize=0, path=cache.path))
+    0
+    >>> _ = cache.get("b")
+    >>> cache.hits, cache.misses, len(cache)
+    (1, 0, 2)
+    >>> RegexCache().save()
+    Traceback (most recent call last):
+    ...
+    ValueError: RegexCache.save() needs a path
+    """
+
+    VERSION = 1
+
+    def __init__(self, maxsize=128, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, s):
+        return s in self.entries
+
+    def get(self, s):
+        entries = self.entries
+        try:
+            M = entries[s]
+        except KeyError:
+            self.misses += 1
+            M = entries[s] = _regex_fa(s)
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        else:
+            self.hits += 1
+            entries.move_to_end(s)
+        return M
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def load(self):
+        with open(self.path, "rb") as fp:
+            version, items = pickle.load(fp)
+        if version != self.VERSION:
+            raise ValueError("Unsupported cache version %r" % (version,))
+        for s, M in items[max(0, len(items) - self.maxsize) :]:
+            self.entries[s] = M
+
+    def save(self):
+        """
+        Write the cache to `path`, replacing the file atomically so that
+        a concurrent reader never sees a partial file.
+        """
+        if self.path is None:
+            raise ValueError("RegexCache.save() needs a path")
+        tmp = "%s.%s.tmp" % (self.path, os.getpid())
+        try:
+            with open(tmp, "wb") as fp:
+                data = (self.VERSION, list(self.entries.items()))
+                pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+_regex_cache = RegexCache()
+
+
 def _same_test(p1, p2):
     """
     >>> _same_test("(a|b*)*", "(a|b)*")
     """
-    Q1, Sigma1, q1, delta1, A1 = _regex_fa(p1)
-    Q2, Sigma2, q2, delta2, A2 = _regex_fa(p2)
-    Sigma = set(Sigma1) | set(Sigma2)
-    Q, Sigma, q0, delta, A = symmetric_difference(
-        Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2
-    )
-    Q, Sigma, q0, delta, A = minimize(Q, Sigma, q0, delta, A)
-    if len(A) > 0:
-        x = shortest_accepted(Q, Sigma, q0, delta, A)
+    Q1, Sigma1, q1, delta1, A1 = _regex_cache.get(p1)
+    Q2, Sigma2, q2, delta2, A2 = _regex_cache.get(p2)
+    Sigma = sorted(set(Sigma1) | set(Sigma2))
+    x = counterexample(Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2)
+    if x is not None:
         a1 = matches(Q1, Sigma1, q1, delta1, A1, x)
         a2 = matches(Q2, Sigma2, q2, delta2, A2, x)
         print(p1)
@@ -542,3 +1340,277 @@ def _same_test(p1, p2):
             print("Accepted not by %r but by %r: %r" % (p1, p2, x))
         else:
             print((x, p1, a1, p2, a2))
+
+
+def _counterexample_product(M1, M2):
+    """
+    Find a shortest string accepted by exactly one of M1 and M2 by
+    minimizing their full symmetric difference, as _same_test used to.
+    """
+    Q1, Sigma1, q1, delta1, A1 = M1
+    Q2, Sigma2, q2, delta2, A2 = M2
+    Sigma = set(Sigma1) | set(Sigma2)
+    Q, Sigma, q0, delta, A = symmetric_difference(
+        Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2
+    )
+    Q, Sigma, q0, delta, A = minimize(Q, Sigma, q0, delta, A)
+    if len(A) > 0:
+        return shortest_accepted(Q, Sigma, q0, delta, A)
+    return None
+
+
+def _random_dfa(n, Sigma, seed=0):
+    rng = random.Random(seed)
+    Q = set(range(n))
+    delta = {(q, sigma): rng.randrange(n) for q in Q for sigma in Sigma}
+    A = {q for q in Q if rng.random() < 0.5}
+    return Q, Sigma, 0, delta, A
+
+
+def _timed(f, *args):
+    t = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - t
+
+
+def _benchmark_minimize():
+    """
+    Compare minimize and _minimize_hopcroft on random DFAs over {a, b}.
+    minimize takes quadratic space, so it is only run on small inputs.
+    """
+    print("%8s %10s %10s %12s" % ("|Q|", "|Q'|", "minimize", "hopcroft"))
+    for n in [100, 200, 400, 800, 10000, 100000]:
+        M = _random_dfa(n, ["a", "b"], seed=n)
+        M2, t2 = _timed(_minimize_hopcroft, *M)
+        if n <= 800:
+            M1, t1 = _timed(minimize, *M)
+            assert len(M1[0]) == len(M2[0])
+            t1 = "%.3f" % t1
+        else:
+            t1 = "-"
+        print("%8s %10s %10s %12.3f" % (n, len(M2[0]), t1, t2))
+
+
+def _benchmark_array_dfa():
+    """
+    Compare memory and matching speed of the tuple and ArrayDFA forms.
+    """
+    import tracemalloc
+
+    n = 100000
+    Sigma = ["a", "b", "c", "d"]
+    tracemalloc.start()
+    M = _random_dfa(n, Sigma)
+    tuple_size = tracemalloc.get_traced_memory()[0]
+    A = ArrayDFA.from_tuple(M)
+    array_size = tracemalloc.get_traced_memory()[0] - tuple_size
+    tracemalloc.stop()
+    print("tuple form: %8.1f MB" % (tuple_size / 1e6))
+    print("ArrayDFA:   %8.1f MB (including names)" % (array_size / 1e6))
+    x = "".join(random.Random(0).choice(Sigma) for i in range(1000000))
+    r1, t1 = _timed(matches, *M, x)
+    r2, t2 = _timed(A.matches, x)
+    assert r1 == r2
+    print("matches: %.3f s, ArrayDFA.matches: %.3f s" % (t1, t2))
+
+
+def _benchmark_matches_many():
+    """
+    Compare matching 10^6 short strings one at a time and in lockstep.
+    """
+    M = ArrayDFA.from_tuple(_regex_fa("(a|b|c)*abba|c*b"))
+    rng = random.Random(0)
+    strings = [
+        "".join(rng.choice("abc") for j in range(rng.randrange(20)))
+        for i in range(1000000)
+    ]
+    r1, t1 = _timed(lambda: [M.matches(x) for x in strings])
+    r2, t2 = _timed(M.matches_many, strings)
+    assert r1 == r2
+    print("%d strings, %d accepted" % (len(strings), sum(r1)))
+    print("one at a time: %.3f s, matches_many: %.3f s" % (t1, t2))
+    if numpy is not None:
+        codes = M.encode(strings)
+        r3, t3 = _timed(M.matches_encoded, codes)
+        assert r3.tolist() == r1
+        print("matches_encoded on pre-encoded input: %.3f s" % t3)
+
+
+def _nth_from_last_nfa(n):
+    """
+    NFA over {a, b} accepting the strings whose n'th symbol from the end
+    is an a, whose minimal DFA has 2^n states.
+    """
+    Q = list(range(n + 1))
+    Sigma = ["a", "b"]
+    delta = {(q, sigma): [q + 1] for q in range(1, n) for sigma in Sigma}
+    delta[0, "a"] = [0, 1]
+    delta[0, "b"] = [0]
+    delta[n, "a"] = delta[n, "b"] = []
+    return Q, Sigma, 0, delta, {n}
+
+
+def _benchmark_determinize():
+    """
+    Compare determinize and _determinize_bitset on an exponential blowup.
+    """
+    print("%4s %8s %12s %12s" % ("n", "|Q'|", "determinize", "bitset"))
+    for n in range(8, 17, 2):
+        M = _nth_from_last_nfa(n)
+        M2, t2 = _timed(_determinize_bitset, *M)
+        if n <= 14:
+            M1, t1 = _timed(determinize, *M)
+            assert len(M1[0]) == len(M2[0])
+            t1 = "%.3f" % t1
+        else:
+            t1 = "-"
+        print("%4s %8s %12s %12.3f" % (n, len(M2[0]), t1, t2))
+
+
+def _benchmark_lambda_elimination():
+    """
+    Compare lambda_elimination and _lambda_elimination_scc on a large
+    alternation, and show the time spent in each stage of _regex_fa.
+    """
+    letters = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    for k in [1, 2, 4]:
+        s = "(%s)*" % "|".join(c + "*" for c in letters * k)
+        M = _parse_nfa(s)
+        M1, t1 = _timed(lambda_elimination, *M)
+        M2, t2 = _timed(_lambda_elimination_scc, *M)
+        print("%d alternatives, %d NFA states" % (len(letters) * k, len(M[0])))
+        print("  lambda_elimination:      %.3f s" % t1)
+        print("  _lambda_elimination_scc: %.3f s" % t2)
+        timings = {}
+        _regex_fa(s, timings)
+        for name, t in timings.items():
+            print("%20s %.3f s" % (name, t))
+
+
+def _size(M):
+    Q, Sigma, q0, delta, A = M
+    return sum(len(targets) for targets in delta.values())
+
+
+def _benchmark_lazy():
+    """
+    Compare full construction with LazyDFA on (a|b)*a(a|b)...(a|b), whose
+    minimal DFA has 2^(n+1) states, matching a random string of length 10^5.
+    """
+    rng = random.Random(0)
+    x = "".join(rng.choice("ab") for i in range(100000))
+    print(
+        "%4s %12s %12s %12s %10s"
+        % ("n", "_regex_fa", "LazyDFA", "transitions", "fallbacks")
+    )
+    for n in [2, 4, 6, 8, 12, 16]:
+        s = "(a|b)*a" + "(a|b)" * n
+        if n <= 8:
+            M, t1 = _timed(_regex_fa, s)
+            r1 = matches(*M, x)
+            t1 = "%.3f" % t1
+        else:
+            r1 = None
+            t1 = "-"
+        L = LazyDFA(s)
+        r2, t2 = _timed(L.matches, x)
+        assert r1 in (None, r2)
+        print("%4s %12s %12.3f %12s %10s" % (n, t1, t2, L.misses, L.fallbacks))
+
+
+def _benchmark_regex_cache():
+    """
+    Time _same_test on pairs of equivalent expressions drawn from a small
+    pool, with caches of different sizes.
+    """
+    rng = random.Random(0)
+    pool = ["(a|b)*", "(a|b*)*", "(a*|b)*", "(a*b*)*", "(b|a)*", "(a*b)*a*"]
+    pool = [s + "a" + "(a|b)" * 4 for s in pool]
+    pairs = [(rng.choice(pool), rng.choice(pool)) for i in range(200)]
+    global _regex_cache
+    saved = _regex_cache
+    for maxsize in [0, len(pool) // 2, len(pool)]:
+        _regex_cache = RegexCache(maxsize=maxsize)
+        _, t = _timed(lambda: [_same_test(p, q) for p, q in pairs])
+        print(
+            "maxsize %3s %8.3f s  hits %5s  misses %5s"
+            % (maxsize, t, _regex_cache.hits, _regex_cache.misses)
+        )
+    _regex_cache = saved
+
+
+def _benchmark_counterexample():
+    """
+    Compare counterexample with the full product construction on automata
+    for (a|b)*a(a|b)...(a|b), which have 2^(n+1) states.
+    """
+    print("%4s %8s %12s %12s" % ("n", "states", "product", "lazy"))
+    for n in [3, 4, 5, 6, 7]:
+        M1 = _regex_fa("(a|b)*a" + "(a|b)" * n)
+        M2 = _regex_fa("(b|a)*a" + "(b|a)" * n)
+        M3 = _regex_fa("(a|b)*b" + "(a|b)" * n)
+        for N in [M2, M3]:
+            x1, t1 = _timed(_counterexample_product, M1, N)
+            Q1, Sigma1, q1, delta1, A1 = M1
+            Q2, Sigma2, q2, delta2, A2 = N
+            Sigma = sorted(Sigma1)
+            args = (Sigma, Q1, q1, delta1, A1, Q2, q2, delta2, A2)
+            x2, t2 = _timed(counterexample, *args)
+            assert (x1 is None) == (x2 is None)
+            assert x2 is None or len(x1) == len(x2)
+            print("%4s %8s %12.3f %12.3f" % (n, len(Q1), t1, t2))
+
+
+def _shortest_paths_concat(Q, Sigma, q0, delta, A):
+    """
+    shortest_paths as it was written before shortest_path_tree, popping
+    from the front of a list and concatenating strings.
+    """
+    paths = {}
+    paths[q0] = ""
+    queue = [q0]
+    while len(queue) > 0:
+        p = queue[0]
+        queue[0:1] = []
+        for sigma in Sigma:
+            q = delta[p, sigma]
+            if q not in paths:
+                paths[q] = paths[p] + sigma
+                queue.append(q)
+    return paths
+
+
+def _benchmark_shortest_paths():
+    """
+    Time the old list-based shortest_paths against shortest_path_tree and
+    shortest_accepted on random DFAs, where the BFS queue grows long, and
+    on chains where only the last state accepts, so that paths are long.
+    """
+    Sigma = ["a", "b"]
+    print("%8s %8s %12s %12s %12s" % ("", "n", "concat", "tree", "accepted"))
+    for n in [10000, 50000, 200000]:
+        M = _random_dfa(n, Sigma)
+        Q, Sigma, q0, delta, A = M
+        _, t1 = _timed(_shortest_paths_concat, *M)
+        _, t2 = _timed(shortest_path_tree, Q, Sigma, q0, delta)
+        _, t3 = _timed(shortest_accepted, *M)
+        print("%8s %8s %12.3f %12.3f %12.3f" % ("random", n, t1, t2, t3))
+    for n in [1000, 10000, 50000]:
+        delta = {}
+        for q in range(n):
+            delta[q, "a"] = min(q + 1, n - 1)
+            delta[q, "b"] = q
+        M = set(range(n)), Sigma, 0, delta, {n - 1}
+        Q, Sigma, q0, delta, A = M
+        _, t1 = _timed(_shortest_paths_concat, *M)
+        _, t2 = _timed(shortest_path_tree, Q, Sigma, q0, delta)
+        x, t3 = _timed(shortest_accepted, *M)
+        assert x == "a" * (n - 1)
+        print("%8s %8s %12.3f %12.3f %12.3f" % ("chain", n, t1, t2, t3))
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name in sys.argv[1:]:
+        globals()["_benchmark_" + name]()
@@ -1,3 +1,8 @@
+import time
+import heapq
+import random
+
+
 GLOBALS = "inf".split()
 PATTERNS = [
     ("inf", r"\infty"),
@@ -111,8 +116,87 @@ def silhouette(B):
         return merge(silhouette(B[:m]), silhouette(B[m:]))
 
 
+def _silhouette_heap(B):
+    """
+    Compute cleanup(silhouette(B)) by sweeping over the x coordinates of
+    the buildings from left to right, keeping the buildings that cover
+    the sweep line in a heap ordered by height. Buildings are removed
+    from the heap lazily, when they are on top and have ended, so the
+    total time is O(n log n).
+
+    >>> _silhouette_heap([[1, 10, 2]])
+    [1, 10, 2]
+    >>> _silhouette_heap([])
+    []
+    >>> _silhouette_heap([[1, 0, 2]])
+    [1, 0, 2]
+    >>> _silhouette_heap([[1, 3, 3], [5, 0, 7]])
+    [1, 3, 3, 0, 7]
+    >>> _silhouette_heap([
+    ...     [1, 11, 5], [2, 6, 7], [3, 13, 9], [12, 7, 16],
+    ...     [14, 3, 25], [19, 18, 22], [23, 13, 29], [24, 4, 28],
+    ... ])
+    [1, 11, 3, 13, 9, 0, 12, 7, 16, 3, 19, 18, 22, 3, 23, 13, 29]
+    >>> rng = random.Random(0)
+    >>> for n in range(1, 60):
+    ...     B = [[l, rng.randrange(0, 10), l + rng.randrange(1, 10)]
+    ...          for l in (rng.randrange(30) for i in range(n))]
+    ...     assert _silhouette_heap(B) == cleanup(silhouette(B)), B
+    """
+    if not B:
+        return []
+    B = sorted(B)
+    xs = sorted({x for l, h, r in B for x in (l, r)})
+    heap = []
+    S = []
+    height = None
+    i = 0
+    for x in xs[:-1]:
+        while i < len(B) and B[i][0] == x:
+            l, h, r = B[i]
+            heapq.heappush(heap, (-h, r))
+            i += 1
+        while heap and heap[0][1] <= x:
+            heapq.heappop(heap)
+        h = -heap[0][0] if heap else 0
+        if h != height:
+            S.extend([x, h])
+            height = h
+    # Every building has ended at the last x coordinate
+    S.append(xs[-1])
+    return S
+
+
+def _benchmark_heap():
+    """
+    Compare cleanup(silhouette(B)) with _silhouette_heap(B) for n random
+    buildings.
+    """
+    rng = random.Random(0)
+    print("%8s %12s %12s" % ("n", "silhouette", "heap"))
+    for n in [1000, 10000, 100000, 1000000]:
+        B = []
+        for i in range(n):
+            l = rng.randrange(10 * n)
+            B.append([l, rng.randrange(1, 1000), l + rng.randrange(1, 100)])
+        t = time.perf_counter()
+        S1 = cleanup(silhouette([list(b) for b in B]))
+        t1 = time.perf_counter() - t
+        t = time.perf_counter()
+        S2 = _silhouette_heap(B)
+        t2 = time.perf_counter() - t
+        assert S1 == S2
+        print("%8s %12.3f %12.3f" % (n, t1, t2))
+
+
 if __name__ == "__main__":
-    for t in range(int(input())):
-        n = int(input())
-        buildings = [list(map(int, input().split())) for i in range(n)]
-        print(" ".join(map(str, cleanup(silhouette(buildings)))))
+    import sys
+
+    if sys.argv[1:]:
+        for name in sys.argv[1:]:
+            globals()["_benchmark_" + name]()
+    else:
+        for t in range(int(input())):
+            n = int(input())
+            buildings = [list(map(int, input().split())) for i in range(n)]
+            print(" ".join(map(str, cleanup(silhouette(buildings)))))
@@ -1,4 +1,12 @@
 # SKIPTEST
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 GLOBALS = "Node".split()
 PATTERNS = [
     ("Node(i, i)", r"\text{node representing the empty suffix}"),
@@ -106,30 +114,100 @@ def _node_label(x, n):
         return "%s,%s" % (n.i, n.j - 1)
 
 
-def _print_trie(root, x, path=""):
-    # print("VISIT", root)
-    # print('RECURSE', ' '.join(map(str, root.c.keys())))
-    print('subgraph "cluster_%s" { color=white; ' % (path,))
-    if root.c:
-        shape = "ellipse"
-    else:
-        shape = "box"
-    print(
-        '"%s%s" [label="%s", margin=0, shape=%s, fontsize=22];'
-        % (path, _node_name(x, root), _node_label(x, root), shape)
-    )
-    for k, c in root.c.items():
-        # print("RECURSE", k)
-        _print_trie(c, x, path + (k or "$"))
-    # print('EDGE', ' '.join(map(str, root.c.keys())))
-    for k, c in root.c.items():
-        # print("EDGE", k)
-        print(
-            '"%s%s" -> "%s%s%s" [arrowhead=none];'
-            % (path, _node_name(x, root), path, k or "$", _node_name(x, c))
-        )
-    print("}")
-    # print("DONE", root)
+def _write_graphviz(root, x, fp):
+    """
+    Write the trie under root as a graphviz digraph to the file object fp.
+    Each node is written as a subgraph containing the subgraphs of its
+    children followed by the edges to them. The traversal uses an explicit
+    stack, so deep tries do not exhaust the recursion limit, and the
+    output is written as it is produced.
+
+    >>> import io
+    >>> fp = io.StringIO()
+    >>> _write_graphviz(_suffix_tree("ab"), "ab", fp)
+    >>> for line in fp.getvalue().splitlines()[2:]:
+    ...     print(line.rstrip())
+    subgraph "cluster_" { color=white;
+    "," [label="", margin=0, shape=ellipse, fontsize=22];
+    subgraph "cluster_a" { color=white;
+    "a0,2,ab$" [label="0,2", margin=0, shape=box, fontsize=22];
+    }
+    subgraph "cluster_b" { color=white;
+    "b1,2,b$" [label="1,2", margin=0, shape=box, fontsize=22];
+    }
+    subgraph "cluster_$" { color=white;
+    "$2,2,$" [label="2,2", margin=0, shape=box, fontsize=22];
+    }
+    "," -> "a0,2,ab$" [arrowhead=none];
+    "," -> "b1,2,b$" [arrowhead=none];
+    "," -> "$2,2,$" [arrowhead=none];
+    }
+    }
+    """
+    write = fp.write
+    write("digraph {\n")
+    write('graph [pad="0", ranksep="0.0", nodesep="0.0", splines=line];\n')
+    # A node on the stack is entered when its name is None, and left
+    # after its children otherwise.
+    stack = [(root, "", None)]
+    while stack:
+        node, path, name = stack.pop()
+        if name is None:
+            name = _node_name(x, node)
+            write('subgraph "cluster_%s" { color=white; \n' % (path,))
+            write(
+                '"%s%s" [label="%s", margin=0, shape=%s, fontsize=22];\n'
+                % (path, name, _node_label(x, node), "ellipse" if node.c else "box")
+            )
+            stack.append((node, path, name))
+            for k, c in reversed(list(node.c.items())):
+                stack.append((c, path + (k or "$"), None))
+        else:
+            for k, c in node.c.items():
+                write(
+                    '"%s%s" -> "%s%s%s" [arrowhead=none];\n'
+                    % (path, name, path, k or "$", _node_name(x, c))
+                )
+            write("}\n")
+    write("}\n")
+
+
+def _write_graphviz_compact(root, x, fp):
+    """
+    Write the trie under root to fp like _write_graphviz, but with nodes
+    numbered in preorder and labelled only by their index range, so that
+    the size of the output is proportional to the number of nodes rather
+    than to the total length of the edge labels.
+
+    >>> import io
+    >>> fp = io.StringIO()
+    >>> _write_graphviz_compact(_suffix_tree("ab"), "ab", fp)
+    >>> print(fp.getvalue(), end="")
+    digraph {
+    graph [pad="0", ranksep="0.0", nodesep="0.0", splines=line];
+    0 [label="", shape=ellipse];
+    1 [label="0,2", shape=box];
+    0 -> 1 [arrowhead=none];
+    2 [label="1,2", shape=box];
+    0 -> 2 [arrowhead=none];
+    3 [label="2,2", shape=box];
+    0 -> 3 [arrowhead=none];
+    }
+    """
+    write = fp.write
+    write("digraph {\n")
+    write('graph [pad="0", ranksep="0.0", nodesep="0.0", splines=line];\n')
+    stack = [(root, None)]
+    n = 0
+    while stack:
+        node, parent = stack.pop()
+        shape = "ellipse" if node.c else "box"
+        write('%d [label="%s", shape=%s];\n' % (n, _node_label(x, node), shape))
+        if parent is not None:
+            write("%d -> %d [arrowhead=none];\n" % (parent, n))
+        stack.extend((c, n) for c in reversed(list(node.c.values())))
+        n += 1
+    write("}\n")
 
 
 def suffix_trie(x):
@@ -141,6 +219,10 @@ def suffix_trie(x):
 
 
 def suffix_trie_2(x):
+    """
+    Unfinished attempt at an online construction, kept for reference;
+    see _suffix_tree for a complete one.
+    """
     x = list(x) + [None]
     root = Node(0, 0)
     root.c[x[0]] = Node(0, None)
@@ -149,14 +231,9 @@ def suffix_trie_2(x):
     for i in range(len(x) + 1):
         # We have constructed the suffix trie for x[0:i].
         for j, (v, a) in enumerate(suffixes):
-            print(
-                "Suffix [%s:%s] " % (j, i)
-                + "".join(x[j:i])
-                + " ends in node %s " % (v,)
-                + "which is at a distance %s from the root" % a
-            )
-            # a is the number of characters on the path from the root
-            # to the beginning of the node v.
+            # Suffix x[j:i] ends in node v, and a is the number of
+            # characters on the path from the root to the beginning of
+            # the node v.
             prev_suffix_length = i - j
             # Where in x[v.i:v.j] does suffix x[j:i] end?
             prev_suffix_end = prev_suffix_length - a
@@ -169,7 +246,6 @@ def suffix_trie_2(x):
                 a += v.length
                 next_suffix_end = 2
                 v = v.c[x[i - 1]]
-                print("Advance to child", v, "at distance", a)
             else:
                 assert x[v.i + prev_suffix_end - 1] == x[i - 1]
                 next_suffix_end = prev_suffix_end + 1
@@ -177,31 +253,24 @@ def suffix_trie_2(x):
             assert 0 < next_suffix_end <= v.length + 1
             if next_suffix_end == v.length + 1:
                 if x[i] in v.c:
-                    print(i, j, "Outgoing edge exists")
+                    # Outgoing edge exists
                     exists = True
                 else:
                     exists = False
                     v.c[x[i]] = Node(i, None)
-                    print(i, j, "Create outgoing edge", v)
             else:
                 if x[v.i + next_suffix_end - 1] == x[i]:
-                    print(i, j, "Next character in current substring")
+                    # Next character in current substring
                     exists = True
                     # Leave v unchanged
                 else:
                     # Split node
-                    print(i, j, "Split node", v)
                     exists = False
                     child = Node(v.i + prev_suffix_end, v.j)
                     v.j = v.i + next_suffix_end - 1
                     child.c = v.c
                     v.c = {x[v.i + next_suffix_end - 1]: child, x[i]: Node(i, None)}
-                    print("Into", v, child)
-            print("Root is", root, "update", j, "to", v, a)
-            print("  ".join("%s %s" % (v, a) for v, a in suffixes))
-            print(", ".join([str(id(v)) for v, a in suffixes]))
             suffixes[j] = (v, a)
-            print(", ".join([str(id(v)) for v, a in suffixes]))
             # if exists:
             #     break
         suffixes.append((root, 0))
@@ -209,8 +278,352 @@ def suffix_trie_2(x):
     return root
 
 
-x = "cacao"
-print("digraph {")
-print('graph [pad="0", ranksep="0.0", nodesep="0.0", splines=line];')
-_print_trie(suffix_trie_2(x), x)
-print("}")
+def _suffix_tree(x):
+    """
+    Build the suffix tree of x with Ukkonen's algorithm in time O(len(x))
+    for a fixed alphabet. While x is read, leaves have j = None, meaning
+    that they extend to the end of the part of x read so far; at the end
+    they are closed with j = len(x) + 1 like the leaves of suffix_trie.
+
+    >>> x = "cacao"
+    >>> root = _suffix_tree(x)
+    >>> sorted(_suffix_starts(root, len(x) + 1))
+    [0, 1, 2, 3, 4, 5]
+    >>> import random
+    >>> rng = random.Random(0)
+    >>> for n in range(1, 200, 7):
+    ...     x = "".join(rng.choice("ab") for i in range(n))
+    ...     assert sorted(_suffix_starts(_suffix_tree(x), n + 1)) == list(range(n + 1))
+    """
+    x = list(x) + [None]
+    root = Node(0, 0)
+    # The active point is where the longest suffix that is already in the
+    # tree ends: `length` characters along the edge x[edge] out of `node`.
+    node = root
+    edge = 0
+    length = 0
+    # Number of suffixes of x[:i+1] that are not yet leaves
+    remainder = 0
+    for i in range(len(x)):
+        remainder += 1
+        last = None
+        while remainder > 0:
+            if length == 0:
+                edge = i
+            if x[edge] not in node.c:
+                node.c[x[edge]] = Node(i, None)
+                if last is not None:
+                    last.suffix_link = node
+                    last = None
+            else:
+                v = node.c[x[edge]]
+                v_length = (i + 1 if v.j is None else v.j) - v.i
+                if length >= v_length:
+                    # Walk down to v
+                    edge += v_length
+                    length -= v_length
+                    node = v
+                    continue
+                if x[v.i + length] == x[i]:
+                    # x[i] is already in the tree, and so are the
+                    # remaining suffixes
+                    if last is not None and node is not root:
+                        last.suffix_link = node
+                    length += 1
+                    break
+                split = Node(v.i, v.i + length)
+                node.c[x[edge]] = split
+                split.c[x[i]] = Node(i, None)
+                v.i += length
+                split.c[x[v.i]] = v
+                if last is not None:
+                    last.suffix_link = split
+                last = split
+            remainder -= 1
+            if node is root and length > 0:
+                length -= 1
+                edge = i - remainder + 1
+            elif node is not root:
+                node = node.suffix_link or root
+    stack = [root]
+    while stack:
+        v = stack.pop()
+        if v.j is None:
+            v.j = len(x)
+        stack.extend(v.c.values())
+    return root
+
+
+def _suffix_starts(root, n):
+    """
+    Return the start of the suffix of each leaf under root, where n is
+    the length of the string including the sentinel.
+    """
+    starts = []
+    stack = [(root, 0)]
+    while stack:
+        v, depth = stack.pop()
+        depth += v.j - v.i
+        if v.c:
+            stack.extend((u, depth) for u in v.c.values())
+        else:
+            starts.append(n - depth)
+    return starts
+
+
+class SuffixArray:
+    """
+    Index of the string or bytes x consisting of the suffix array `sa`
+    (the start positions of the suffixes of x in sorted order) and the
+    array `lcp`, where lcp[k] is the length of the longest common prefix
+    of the suffixes sa[k - 1] and sa[k]. Both are stored as arrays of
+    machine integers, and no per-node objects are created.
+    The suffix array is built by prefix doubling in O(n log^2 n) time,
+    vectorized with NumPy if it is available.
+
+    >>> index = SuffixArray("cacao")
+    >>> list(index.sa), list(index.lcp)
+    ([1, 3, 0, 2, 4], [0, 1, 0, 2, 0])
+    >>> index.count("ca"), index.find("ca"), index.find("x")
+    (2, [0, 2], [])
+    >>> index.count(""), index.find("cao")
+    (5, [2])
+    >>> SuffixArray(b"abracadabra").find(b"abra")
+    [0, 7]
+    """
+
+    __slots__ = ("x", "sa", "lcp")
+
+    def __init__(self, x, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.x = x
+        typecode = "i" if len(x) <= 0x7FFFFFFF else "q"
+        if use_numpy:
+            sa = _suffix_array_numpy(x)
+            self.sa = array.array(typecode, sa.astype(typecode).tobytes())
+        else:
+            codes = [x[i : i + 1] for i in range(len(x))]
+            self.sa = array.array(typecode, _suffix_array(codes))
+        self.lcp = _lcp_array(x, self.sa, typecode)
+
+    def __len__(self):
+        return len(self.x)
+
+    def _range(self, p):
+        """
+        Return the range [lo, hi) of indices k in sa such that p is a
+        prefix of the suffix sa[k].
+        """
+        x, sa, m = self.x, self.sa, len(p)
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if x[sa[mid] : sa[mid] + m] < p:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if x[sa[mid] : sa[mid] + m] <= p:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def count(self, p):
+        """
+        Return the number of occurrences of p in x in time O(|p| log n).
+        """
+        lo, hi = self._range(p)
+        return hi - lo
+
+    def find(self, p):
+        """
+        Return the sorted start positions of the occurrences of p in x.
+        """
+        lo, hi = self._range(p)
+        return sorted(self.sa[lo:hi])
+
+
+def _suffix_array(codes):
+    """
+    Sort the suffixes of the sequence `codes` of comparable symbols by
+    prefix doubling: after the round for k, rank[i] is the rank of
+    codes[i:i + 2k] among all substrings of that length.
+
+    >>> _suffix_array(list("mississippi"))
+    [10, 7, 4, 1, 0, 9, 8, 6, 3, 5, 2]
+    """
+    n = len(codes)
+    sa = sorted(range(n), key=codes.__getitem__)
+    rank = [0] * n
+    for j in range(1, n):
+        rank[sa[j]] = rank[sa[j - 1]] + (codes[sa[j]] != codes[sa[j - 1]])
+    k = 1
+    while n and rank[sa[-1]] < n - 1:
+
+        def key(i):
+            return (rank[i], rank[i + k] if i + k < n else -1)
+
+        sa.sort(key=key)
+        new_rank = [0] * n
+        for j in range(1, n):
+            new_rank[sa[j]] = new_rank[sa[j - 1]] + (key(sa[j]) != key(sa[j - 1]))
+        rank = new_rank
+        k *= 2
+    return sa
+
+
+def _suffix_array_numpy(x):
+    """
+    Prefix doubling on the code points (or bytes) of x with NumPy,
+    using one lexsort per round.
+
+    >>> list(_suffix_array_numpy("mississippi")) == _suffix_array(list("mississippi"))
+    True
+    """
+    if isinstance(x, str):
+        codes = numpy.frombuffer(x.encode("utf-32-le"), dtype="<u4")
+    else:
+        codes = numpy.frombuffer(bytes(x), dtype=numpy.uint8)
+    n = len(codes)
+    rank = numpy.unique(codes, return_inverse=True)[1].astype(numpy.int64)
+    sa = numpy.argsort(rank, kind="stable")
+    k = 1
+    while n and rank.max() < n - 1:
+        second = numpy.full(n, -1, dtype=numpy.int64)
+        second[: n - k] = rank[k:]
+        sa = numpy.lexsort((second, rank))
+        first, second = rank[sa], second[sa]
+        step = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        rank = numpy.empty(n, dtype=numpy.int64)
+        rank[sa] = numpy.concatenate(([0], numpy.cumsum(step)))
+        k *= 2
+    return sa
+
+
+def _lcp_array(x, sa, typecode):
+    """
+    Kasai's algorithm: the LCP of a suffix with its predecessor in sa is
+    at least one less than that of the suffix starting one later.
+    """
+    n = len(sa)
+    rank = array.array(typecode, [0]) * n
+    for k in range(n):
+        rank[sa[k]] = k
+    lcp = array.array(typecode, [0]) * n
+    h = 0
+    for i in range(n):
+        k = rank[i]
+        if k == 0:
+            h = 0
+            continue
+        j = sa[k - 1]
+        while i + h < n and j + h < n and x[i + h] == x[j + h]:
+            h += 1
+        lcp[k] = h
+        if h > 0:
+            h -= 1
+    return lcp
+
+
+def _benchmark_ukkonen():
+    """
+    Time _suffix_tree on random strings over a four-letter alphabet of
+    growing length, and suffix_trie on the shorter ones. The cyclic
+    garbage collector is disabled while timing, since its passes over the
+    growing number of live nodes would otherwise dominate.
+    """
+    import gc
+    import time
+    import random
+
+    rng = random.Random(0)
+    print("%8s %10s %10s %12s" % ("n", "trie", "ukkonen", "us per char"))
+    for n in [1000, 10000, 100000, 1000000]:
+        x = "".join(rng.choice("acgt") for i in range(n))
+        if n <= 10000:
+            t = time.perf_counter()
+            suffix_trie(x)
+            t1 = "%.3f" % (time.perf_counter() - t)
+        else:
+            t1 = "-"
+        gc.disable()
+        t = time.perf_counter()
+        root = _suffix_tree(x)
+        t2 = time.perf_counter() - t
+        gc.enable()
+        assert len(_suffix_starts(root, n + 1)) == n + 1
+        print("%8s %10s %10.3f %12.2f" % (n, t1, t2, 1e6 * t2 / n))
+
+
+def _benchmark_suffix_array():
+    """
+    Time SuffixArray with and without NumPy on random strings, and report
+    the memory used by the arrays per input character.
+    """
+    import time
+    import random
+
+    rng = random.Random(0)
+    print("%8s %10s %10s %10s" % ("n", "python", "numpy", "bytes/char"))
+    for n in [1000, 10000, 100000, 1000000]:
+        x = "".join(rng.choice("acgt") for i in range(n))
+        if n <= 100000:
+            t = time.perf_counter()
+            a = SuffixArray(x, use_numpy=False)
+            t1 = "%.3f" % (time.perf_counter() - t)
+        else:
+            a = None
+            t1 = "-"
+        t2 = "-"
+        if numpy is not None:
+            t = time.perf_counter()
+            b = SuffixArray(x, use_numpy=True)
+            t2 = "%.3f" % (time.perf_counter() - t)
+            assert a is None or (a.sa == b.sa and a.lcp == b.lcp)
+            a = b
+        size = a.sa.itemsize + a.lcp.itemsize
+        print("%8s %10s %10s %10s" % (n, t1, t2, size))
+
+
+def _benchmark_graphviz():
+    """
+    Time _write_graphviz and _write_graphviz_compact on suffix trees of
+    random strings, discarding the output. A tree for n characters has up
+    to 2n + 1 nodes, but the edge labels written by _write_graphviz have
+    total length quadratic in n, so it is only run on the smaller trees.
+    """
+    import os
+    import time
+    import random
+
+    rng = random.Random(0)
+    print("%8s %10s %10s" % ("n", "full", "compact"))
+    for n in [1000, 10000, 100000, 1000000]:
+        x = "".join(rng.choice("acgt") for i in range(n))
+        root = _suffix_tree(x)
+        with open(os.devnull, "w") as fp:
+            t1 = "-"
+            if n <= 1000:
+                t = time.perf_counter()
+                _write_graphviz(root, x, fp)
+                t1 = "%.3f" % (time.perf_counter() - t)
+            t = time.perf_counter()
+            _write_graphviz_compact(root, x, fp)
+            t2 = time.perf_counter() - t
+        print("%8s %10s %10.3f" % (n, t1, t2))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:]:
+        for name in sys.argv[1:]:
+            globals()["_benchmark_" + name]()
+    else:
+        x = "cacao"
+        _write_graphviz(_suffix_tree(x), x, sys.stdout)
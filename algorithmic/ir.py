@@ -0,0 +1,176 @@
+import ast
+import pickle
+
+
+IR_VERSION = 1
+
+
+class Group:
+    """
+    A node in the intermediate representation built by Visitor.
+
+    `kind` is one of "module", "function", "statement", "block", "math",
+    "node" or "pattern", and `attr` carries kind-specific data (the index
+    of the pattern for "pattern", the visited type name otherwise).
+    `children` is a list of Group objects and strings of output text.
+
+    >>> b = Builder()
+    >>> with b.group("statement", "Return"):
+    ...     b("return $", end="")
+    ...     with b.group("math", "Num"):
+    ...         b(42, end="")
+    ...     b("$")
+    >>> b.root
+    Group('root', None, [Group('statement', 'Return', ['return $', Group('math', 'Num', ['42']), '$\\n'])])
+    >>> emit(loads(dumps(b.root)), print)
+    return $42$
+    """
+
+    def __init__(self, kind, attr=None, children=None):
+        self.kind = kind
+        self.attr = attr
+        self.children = [] if children is None else children
+
+    def __repr__(self):
+        return "Group(%r, %r, %r)" % (self.kind, self.attr, self.children)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Group)
+            and self.kind == other.kind
+            and self.attr == other.attr
+            and self.children == other.children
+        )
+
+    def text(self):
+        parts = []
+        emit(self, lambda s, end: parts.append(s))
+        return "".join(parts)
+
+
+class _GroupContext:
+    def __init__(self, builder, group):
+        self.builder = builder
+        self.group = group
+
+    def __enter__(self):
+        self.builder._stack.append(self.group)
+        return self.group
+
+    def __exit__(self, *exc):
+        self.builder._stack.pop()
+
+
+class _NoGroup:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_GROUP = _NoGroup()
+
+
+def no_group(kind, attr=None):
+    return NO_GROUP
+
+
+class Builder:
+    """
+    A `print` replacement for Visitor that records output into a tree of
+    Group objects instead of writing it out.
+    Adjacent pieces of text within the same group are merged.
+    """
+
+    def __init__(self):
+        self.root = Group("root")
+        self._stack = [self.root]
+
+    def __call__(self, *args, sep=" ", end="\n", file=None):
+        s = sep.join(map(str, args)) + end
+        if not s:
+            return
+        children = self._stack[-1].children
+        if children and isinstance(children[-1], str):
+            children[-1] += s
+        else:
+            children.append(s)
+
+    def group(self, kind, attr=None):
+        g = Group(kind, attr)
+        self._stack[-1].children.append(g)
+        return _GroupContext(self, g)
+
+    def append(self, tree):
+        """
+        Insert a tree recorded by another Builder at the current position.
+        """
+        self._stack[-1].children.append(tree)
+
+
+def node_kind(node):
+    if isinstance(node, list):
+        return "block"
+    elif isinstance(node, ast.Module):
+        return "module"
+    elif isinstance(node, ast.FunctionDef):
+        return "function"
+    elif isinstance(node, ast.stmt):
+        return "statement"
+    elif isinstance(node, ast.expr):
+        return "math"
+    else:
+        return "node"
+
+
+def emit(tree, print):
+    """
+    Write out the text of `tree` using the given `print` function.
+    """
+    stack = [iter([tree])]
+    while stack:
+        for child in stack[-1]:
+            if isinstance(child, str):
+                print(child, end="")
+            else:
+                stack.append(iter(child.children))
+                break
+        else:
+            stack.pop()
+
+
+def _encode(tree):
+    if isinstance(tree, str):
+        return tree
+    return (tree.kind, tree.attr, tuple(_encode(c) for c in tree.children))
+
+
+def _decode(data):
+    if isinstance(data, str):
+        return data
+    kind, attr, children = data
+    return Group(kind, attr, [_decode(c) for c in children])
+
+
+def dumps(tree):
+    """
+    Serialize `tree` as plain nested tuples and strings, so that the
+    on-disk format does not depend on the class layout in this module.
+    """
+    return pickle.dumps((IR_VERSION, _encode(tree)), pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    version, tree = pickle.loads(data)
+    if version != IR_VERSION:
+        raise ValueError("Unsupported IR version %r" % (version,))
+    return _decode(tree)
+
+
+def dump(tree, fp):
+    fp.write(dumps(tree))
+
+
+def load(fp):
+    return loads(fp.read())
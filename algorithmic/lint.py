@@ -0,0 +1,218 @@
+import ast
+from .pattern import Matcher
+
+
+class SubsumptionMatcher(Matcher):
+    """
+    Match the pattern `p` against the pattern tree of `q`, treating the
+    variables of `q` as unknown subtrees. A match means that every node
+    matched by `q` is also matched by `p`.
+    """
+
+    __slots__ = ("q_variables",)
+
+    def __init__(self, p, q):
+        super().__init__(p.variables)
+        self.q_variables = frozenset(q.variables)
+
+    def unify(self, name, value):
+        i = self.slots.get(name.id)
+        if i is None:
+            # A global name in p only matches the same global name in q
+            return (
+                isinstance(value, ast.Name)
+                and value.id == name.id
+                and value.id not in self.q_variables
+            )
+        if isinstance(value, ast.Starred):
+            # A starred variable in q may stand for any number of elements
+            return False
+        return super().unify(name, value)
+
+
+def subsumes(p, q):
+    """
+    Return True if every node matched by the Pattern `q` is also matched
+    by the Pattern `p`.
+
+    >>> from .pattern import Pattern
+    >>> subsumes(Pattern.compile("for x in y: b\\n"),
+    ...          Pattern.compile("for x in range(n): b\\n", globals={"range"}))
+    True
+    >>> subsumes(Pattern.compile("len(a)", globals={"len"}),
+    ...          Pattern.compile("len(a)"))
+    False
+    >>> subsumes(Pattern.compile("[a, b]"), Pattern.compile("[x, *c]"))
+    False
+    >>> subsumes(Pattern.compile("a == a"), Pattern.compile("x == y"))
+    False
+    """
+    if p.is_expr != q.is_expr:
+        return False
+    matcher = SubsumptionMatcher(p, q)
+    return matcher.match(p.node, q.node) is not None
+
+
+def _is_variable(node, variables):
+    if isinstance(node, ast.Name):
+        return node.id in variables
+    if isinstance(node, list) and len(node) == 1:
+        e = node[0]
+        return (
+            isinstance(e, ast.Expr)
+            and isinstance(e.value, ast.Name)
+            and e.value.id in variables
+        )
+    return False
+
+
+def _has_starred_variable(nodes, variables):
+    return any(
+        isinstance(e, ast.Starred) and _is_variable(e.value, variables) for e in nodes
+    )
+
+
+_NOT_LITERAL = object()
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return _NOT_LITERAL
+
+
+def _disjoint(a, b, p_vars, q_vars):
+    if _is_variable(a, p_vars) or _is_variable(b, q_vars):
+        return False
+    if type(a) != type(b):
+        return True
+    if isinstance(a, list):
+        if _has_starred_variable(a, p_vars) or _has_starred_variable(b, q_vars):
+            return False
+        return len(a) != len(b) or any(
+            _disjoint(c, d, p_vars, q_vars) for c, d in zip(a, b)
+        )
+    if not isinstance(a, ast.AST):
+        return a != b
+    a_lit = _literal(a)
+    b_lit = _literal(b)
+    if a_lit is not _NOT_LITERAL and b_lit is not _NOT_LITERAL:
+        return a_lit != b_lit
+    if a_lit is not _NOT_LITERAL or b_lit is not _NOT_LITERAL:
+        # Matcher compares literals by value, e.g. {1, 2} matches {2, 1},
+        # so a structural comparison is not conclusive.
+        return False
+    return any(
+        _disjoint(getattr(a, f), getattr(b, f), p_vars, q_vars)
+        for f in a._fields
+        if f != "ctx"
+    )
+
+
+def disjoint(p, q):
+    """
+    Return True if no node can be matched by both of the Patterns `p` and
+    `q`, in which case their relative order does not affect the output.
+    May return False for patterns that are in fact disjoint.
+
+    >>> from .pattern import Pattern
+    >>> disjoint(Pattern.compile("min(a, b)", globals={"min"}),
+    ...          Pattern.compile("max(a, b)", globals={"max"}))
+    True
+    >>> disjoint(Pattern.compile("min(a, b)", globals={"min"}),
+    ...          Pattern.compile("f(a, b)"))
+    False
+    >>> disjoint(Pattern.compile("[x, *c]"), Pattern.compile("[]"))
+    False
+    """
+    if p.is_expr != q.is_expr:
+        return True
+    return _disjoint(p.node, q.node, frozenset(p.variables), frozenset(q.variables))
+
+
+def shadowed_patterns(patterns):
+    """
+    Given a list of (Pattern, repl) as in Visitor.patterns, return a dict
+    mapping the index of each pattern that can never be applied to the
+    index of an earlier pattern that takes precedence over it.
+    Only string replacements are considered to take precedence, since a
+    callable replacement may decline to handle a node.
+
+    >>> from .pattern import Pattern
+    >>> shadowed_patterns([
+    ...     (Pattern.compile("for x in y: b\\n"), ""),
+    ...     (Pattern.compile("for x in range(n): b\\n", globals={"range"}), ""),
+    ... ])
+    {1: 0}
+    """
+    shadowed = {}
+    for j, (q, q_repl) in enumerate(patterns):
+        for i in range(j):
+            p, p_repl = patterns[i]
+            if isinstance(p_repl, str) and subsumes(p, q):
+                shadowed[j] = i
+                break
+    return shadowed
+
+
+def optimized_order(patterns, hits):
+    """
+    Return a permutation of range(len(patterns)) that tries patterns with
+    more `hits` (a dict or list of counts by index) first, subject to the
+    constraint that any two patterns that are not disjoint keep their
+    relative order. Patterns in `shadowed_patterns` are left out.
+    Visitor produces the same output with the reordered patterns, since
+    the first pattern that matches a node is the same in both orders.
+
+    >>> from .pattern import Pattern
+    >>> ps = [
+    ...     (Pattern.compile("None"), "a"),
+    ...     (Pattern.compile("x + 1"), "b"),
+    ...     (Pattern.compile("x + y"), "c"),
+    ...     (Pattern.compile("x + 1"), "d"),
+    ... ]
+    >>> optimized_order(ps, {1: 3, 2: 10})
+    [1, 2, 0]
+    """
+    shadowed = shadowed_patterns(patterns)
+    remaining = [i for i in range(len(patterns)) if i not in shadowed]
+    before = {
+        j: {
+            i
+            for i in remaining
+            if i < j and not disjoint(patterns[i][0], patterns[j][0])
+        }
+        for j in remaining
+    }
+    order = []
+    placed = set()
+    while remaining:
+        ready = [j for j in remaining if before[j] <= placed]
+        j = max(ready, key=lambda j: (_hit_count(hits, j), -j))
+        order.append(j)
+        placed.add(j)
+        remaining.remove(j)
+    return order
+
+
+def _hit_count(hits, i):
+    try:
+        return hits[i]
+    except (KeyError, IndexError):
+        return 0
+
+
+def lint_report(patterns, hits, print=print):
+    """
+    Print the shadowed patterns and the optimized order of `patterns`.
+    """
+    shadowed = shadowed_patterns(patterns)
+    for j, i in sorted(shadowed.items()):
+        print("%% Pattern %s is shadowed by pattern %s:" % (j, i))
+        print("%%   %r" % (patterns[j][0],))
+        print("%%   %r" % (patterns[i][0],))
+    print("% Optimized order:")
+    for i in optimized_order(patterns, hits):
+        p, repl = patterns[i]
+        print("%s\t%s\t%r" % (i, _hit_count(hits, i), p))
@@ -1,10 +1,16 @@
 import os
 import ast
+import pickle
+import hashlib
+import tempfile
 import argparse
 import functools
 import subprocess
 import collections
-from .visitor import Visitor
+import concurrent.futures
+from . import ir
+from .lint import lint_report
+from .visitor import Visitor, PATTERNS, GLOBALS, VARS
 
 
 PREAMBLE = r"""
@@ -21,18 +27,134 @@ POSTAMBLE = r"""
 """.strip()
 
 
+@functools.lru_cache(maxsize=None)
+def _package_digest():
+    """
+    Hash of the source of the modules in this package, which determine
+    the IR that is built for a given input.
+    """
+    h = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py") and name != "tests.py":
+            h.update(name.encode())
+            with open(os.path.join(directory, name), "rb") as fp:
+                h.update(fp.read())
+    return h.hexdigest()
+
+
+def ir_cache_key(source):
+    """
+    Key for the IR of `source`, which also covers the built-in patterns
+    and the code of this package so that cached IR is not reused after
+    they change.
+    """
+    h = hashlib.sha1()
+    h.update(str(ir.IR_VERSION).encode())
+    h.update(_package_digest().encode())
+    h.update(repr((PATTERNS, GLOBALS, VARS)).encode())
+    h.update(source.encode())
+    return h.hexdigest()
+
+
+def build_ir(source, filename, jobs=1):
+    if jobs > 1:
+        return build_ir_parallel(source, filename, jobs)
+    o = ast.parse(source, filename, "exec")
+    builder = ir.Builder()
+    Visitor(source, print=builder).visit(o)
+    return builder.root
+
+
+def _build_function_irs(source, filename, indices):
+    """
+    Render the top-level functions at the given positions in the module
+    body, replaying the PATTERNS and GLOBALS assignments that precede them.
+    """
+    o = ast.parse(source, filename, "exec")
+    builder = ir.Builder()
+    visitor = Visitor(source, print=builder)
+    wanted = set(indices)
+    for i, child in enumerate(o.body[: max(indices) + 1]):
+        if not isinstance(child, ast.FunctionDef):
+            visitor.module_statement(child)
+        elif i in wanted:
+            visitor.visit(child)
+    return builder.root.children, visitor.unhandled
+
+
+def build_ir_parallel(source, filename, jobs):
+    """
+    Like build_ir, but render the top-level functions in `jobs` processes.
+    The result is identical to that of build_ir.
+    """
+    o = ast.parse(source, filename, "exec")
+    functions = [
+        i for i, child in enumerate(o.body) if isinstance(child, ast.FunctionDef)
+    ]
+    n = min(len(functions), jobs * 4)
+    chunks = [
+        functions[len(functions) * k // n : len(functions) * (k + 1) // n]
+        for k in range(n)
+    ]
+    builder = ir.Builder()
+    visitor = Visitor(source, print=builder)
+    with builder.group(ir.node_kind(o), type(o).__name__):
+        visitor.module_header()
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = executor.map(
+                _build_function_irs,
+                [source] * n,
+                [filename] * n,
+                chunks,
+            )
+            for trees, unhandled in results:
+                for tree in trees:
+                    builder.append(tree)
+                visitor.unhandled |= unhandled
+        visitor.module_footer()
+    return builder.root
+
+
+def cached_ir(source, filename, cache_dir, jobs=1):
+    if cache_dir is None:
+        return build_ir(source, filename, jobs)
+    path = os.path.join(cache_dir, ir_cache_key(source) + ".ir")
+    try:
+        with open(path, "rb") as fp:
+            return ir.load(fp)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        # Missing, outdated or corrupt cache entry
+        pass
+    tree = build_ir(source, filename, jobs)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a unique temporary file so that concurrent runs do not
+    # clobber each other's partial output.
+    fp = tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False)
+    try:
+        with fp:
+            ir.dump(tree, fp)
+        os.replace(fp.name, path)
+    except BaseException:
+        os.unlink(fp.name)
+        raise
+    return tree
+
+
 def main(argv=None, quiet=False):
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--output-and-compile", action="store_true")
     parser.add_argument("-p", "--preamble", action="store_true")
     parser.add_argument("-3", "--new-style", action="store_true")
+    parser.add_argument("--ir-cache", metavar="DIRECTORY")
+    parser.add_argument("-j", "--jobs", type=int, default=1)
     parser.add_argument("filename", nargs="+")
     args = parser.parse_args(argv)
     output_preamble = args.preamble or args.output_and_compile
     for filename in args.filename:
         with open(filename) as fp:
             source = fp.read()
-        o = ast.parse(source, filename, "exec")
+        tree = cached_ir(source, filename, args.ir_cache, args.jobs)
         if args.output_and_compile:
             base, ext = os.path.splitext(filename)
             output_filename = base + ".tex"
@@ -40,22 +162,21 @@ def main(argv=None, quiet=False):
             out_print = functools.partial(print, file=ofp)
         else:
             out_print = print
-        visitor = Visitor(source, print=out_print)
         if output_preamble:
-            visitor.print(PREAMBLE)
+            out_print(PREAMBLE)
         if args.new_style:
-            visitor.print(r"\newcommand{\eq}{==}")
-            visitor.print(r"\renewcommand{\gets}{=}")
-            visitor.print(r"\renewcommand{\land}{\mathbin{\text{and}}}")
-            visitor.print(r"\renewcommand{\lor}{\mathbin{\text{or}}}")
+            out_print(r"\newcommand{\eq}{==}")
+            out_print(r"\renewcommand{\gets}{=}")
+            out_print(r"\renewcommand{\land}{\mathbin{\text{and}}}")
+            out_print(r"\renewcommand{\lor}{\mathbin{\text{or}}}")
         try:
-            visitor.visit(o)
+            ir.emit(tree, out_print)
         except:
             if args.output_and_compile:
                 ofp.close()
             raise
         if output_preamble:
-            visitor.print(POSTAMBLE)
+            out_print(POSTAMBLE)
         if args.output_and_compile:
             ofp.close()
             quiet_args = {}
@@ -90,3 +211,22 @@ def pattern_stats():
 
     for i, p in enumerate(visitor.patterns):
         print("%s\t%r" % (",".join(pattern_usage[i - len(visitor.patterns)]), p))
+
+
+def pattern_lint():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", nargs="+")
+    args = parser.parse_args()
+
+    def noop(*args, **kwargs):
+        pass
+
+    for filename in args.filename:
+        with open(filename) as fp:
+            source = fp.read()
+        o = ast.parse(source, filename, "exec")
+        p = collections.defaultdict(int)
+        visitor = Visitor(source, print=noop, pattern_stats=p)
+        visitor.visit(o)
+        print("%% %s" % (filename,))
+        lint_report(visitor.patterns, p)
@@ -18,7 +18,7 @@ def node_eq(a, b):
     >>> node_eq(left, right)
     True
     """
-    return bool(Matcher(None).generic_visit(a, b))
+    return bool(_EQ_MATCHER.generic_visit(a, b))
 
 
 def pattern_match(a, b, globals=None):
@@ -61,26 +61,75 @@ def pattern_match(a, b, globals=None):
 
     if globals is None:
         globals = []
-    bindings = {}
+    return Matcher(pattern_variables(a, globals)).match(a, b)
 
-    def unify(name, value):
-        if name.id in globals:
-            binding = name
-        else:
-            binding = bindings.setdefault(name.id, value)
-        return node_eq(binding, value)
 
-    result = Matcher(unify).generic_visit(a, b)
-    if result:
-        return bindings
+def pattern_variables(a, globals):
+    """
+    Return the names in the pattern `a` that are not in `globals`,
+    in the order in which Matcher visits them.
+
+    >>> pattern_variables(ast.parse('for x in range(n): b'), ['range'])
+    ('x', 'n', 'b')
+    """
+    names = {}
+    stack = [a]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, ast.Name):
+            if x.id not in globals:
+                names.setdefault(x.id, len(names))
+        elif isinstance(x, list):
+            stack.extend(reversed(x))
+        elif isinstance(x, ast.AST):
+            stack.extend(getattr(x, f, None) for f in reversed(x._fields))
+    return tuple(names)
+
+
+_UNBOUND = object()
 
 
 class Matcher:
-    def __init__(self, unify):
-        self.unify = unify
+    """
+    Structural matcher of a pattern against an AST.
+
+    `variables` is the tuple of names to unify, or None to compare the
+    trees exactly (as in node_eq). Bindings are stored in a list
+    indexed by the position of the name in `variables`, which is reset
+    and reused on every call to match(); a dict is only created for
+    successful matches.
+    """
+
+    __slots__ = ("variables", "slots", "bindings", "_unbound")
+
+    def __init__(self, variables):
+        self.variables = variables
+        if variables is None:
+            self.slots = None
+        else:
+            self.slots = {v: i for i, v in enumerate(variables)}
+            self._unbound = (_UNBOUND,) * len(variables)
+            self.bindings = list(self._unbound)
+
+    def match(self, a, b):
+        bindings = self.bindings
+        bindings[:] = self._unbound
+        if self.generic_visit(a, b):
+            return {v: x for v, x in zip(self.variables, bindings) if x is not _UNBOUND}
+
+    def unify(self, name, value):
+        i = self.slots.get(name.id)
+        if i is None:
+            # Global name
+            return node_eq(name, value)
+        binding = self.bindings[i]
+        if binding is _UNBOUND:
+            self.bindings[i] = value
+            return True
+        return node_eq(binding, value)
 
     def generic_visit(self, a, b):
-        if self.unify and isinstance(a, ast.Name):
+        if self.slots is not None and isinstance(a, ast.Name):
             return self.unify(a, b)
         if type(a) != type(b):
             return False
@@ -122,7 +171,7 @@ class Matcher:
         assert len(x) >= 1
         assert len(y) >= 1
         is_name = isinstance(x[0], ast.Expr) and isinstance(x[0].value, ast.Name)
-        if is_name and self.unify:
+        if is_name and self.slots is not None:
             return self.unify(x[0].value, y)
         else:
             return self.generic_visit(x, y)
@@ -132,7 +181,7 @@ class Matcher:
     def expr_list_visit(self, x, y):
         assert isinstance(x, list)
         assert isinstance(y, list)
-        if not self.unify:
+        if self.slots is None:
             return self.generic_visit(x, y)
         starred_idx = [
             i
@@ -156,6 +205,9 @@ class Matcher:
     visit_List_elts = visit_Call_args = expr_list_visit
 
 
+_EQ_MATCHER = Matcher(None)
+
+
 def _str_sub(repl, expr, matches, print, visit):
     i = 0
     for mo in re.finditer("#(\w+)", repl):
@@ -173,6 +225,8 @@ def _str_sub(repl, expr, matches, print, visit):
 
 
 class Pattern:
+    __slots__ = ("node", "is_expr", "globals", "source", "_matcher")
+
     def __init__(self, node, is_expr, globals):
         assert isinstance(node, ast.AST)
         assert isinstance(is_expr, bool)
@@ -180,6 +234,7 @@ class Pattern:
         self.is_expr = is_expr
         self.globals = globals
         self.source = None
+        self._matcher = Matcher(pattern_variables(node, globals or ()))
 
     @classmethod
     def compile(cls, pattern, *, globals=None):
@@ -199,13 +254,30 @@ class Pattern:
         else:
             return "<Pattern>"
 
+    @property
+    def variables(self):
+        return self._matcher.variables
+
+    @property
+    def root_type(self):
+        """
+        The type of AST node this pattern can match,
+        or None if the pattern is a variable that matches anything.
+        """
+        if isinstance(self.node, ast.Name) and self.node.id in self.variables:
+            return None
+        return type(self.node)
+
     def match(self, target):
-        return pattern_match(self.node, target, globals=self.globals)
+        return self._matcher.match(self.node, target)
+
+    def apply(self, mo, repl, **kwargs):
+        if isinstance(repl, str):
+            return _str_sub(repl, self.is_expr, mo, **kwargs)
+        else:
+            return repl(**kwargs)
 
     def sub(self, target, repl, **kwargs):
         mo = self.match(target)
         if mo is not None:
-            if isinstance(repl, str):
-                return _str_sub(repl, self.is_expr, mo, **kwargs)
-            else:
-                return repl(**kwargs)
+            return self.apply(mo, repl, **kwargs)
@@ -1,9 +1,14 @@
 import io
 import os
 import ast
+import tempfile
 import unittest
 import functools
-from algorithmic import Visitor, pattern_match, main
+import contextlib
+import collections
+from algorithmic import Visitor, Pattern, pattern_match, main, ir
+from algorithmic.main import build_ir
+from algorithmic.lint import shadowed_patterns, optimized_order
 
 
 class PatternMatchTest(unittest.TestCase):
@@ -77,6 +82,15 @@ class PatternMatchTest(unittest.TestCase):
     def test_call_args_star(self):
         self.positive("print(*x)", "print(1, 2)")
 
+    def test_pattern_reuse(self):
+        po = Pattern.compile("f(a, a, b)", globals=frozenset(["f"]))
+        self.assertEqual(po.variables, ("a", "b"))
+        self.assertIsNone(po.match(ast.parse("f(1, 2, 3)").body[0].value))
+        mo = po.match(ast.parse("f(x, x, 3)").body[0].value)
+        self.assertEqual(sorted(mo.keys()), ["a", "b"])
+        self.assertEqual(mo["a"].id, "x")
+        self.assertIsNone(po.match(ast.parse("g(x, x, 3)").body[0].value))
+
 
 class AlgorithmicpyTest(unittest.TestCase):
     def runner(self, py, tex):
@@ -149,6 +163,130 @@ class AlgorithmicpyTest(unittest.TestCase):
             "\\WHILE{$n < 1$}\n\\STATE $n \\gets n + 1$\n\\ENDWHILE",
         )
 
+    def test_patterns_for(self):
+        visitor = Visitor(source="")
+        self.assertEqual(visitor.patterns_for(ast.Name), [])
+        self.assertEqual(len(visitor.patterns_for(ast.For)), 9)
+        visitor.extend_patterns([("a", "x")])
+        self.assertEqual(len(visitor.patterns_for(ast.Name)), 1)
+        self.assertEqual(len(visitor.patterns_for(ast.For)), 10)
+
+
+class IRTest(unittest.TestCase):
+    source = "def f(n):\n    for i in range(n):\n        x = len(i)\n    return x\n"
+
+    def direct_output(self):
+        with io.StringIO() as buf:
+            visitor = Visitor(
+                print=functools.partial(print, file=buf), source=self.source
+            )
+            visitor.visit(ast.parse(self.source))
+            return buf.getvalue()
+
+    def test_emit(self):
+        builder = ir.Builder()
+        Visitor(print=builder, source=self.source).visit(ast.parse(self.source))
+        self.assertEqual(builder.root.text(), self.direct_output())
+
+    def test_roundtrip(self):
+        builder = ir.Builder()
+        Visitor(print=builder, source=self.source).visit(ast.parse(self.source))
+        tree = ir.loads(ir.dumps(builder.root))
+        self.assertEqual(tree, builder.root)
+        (module,) = tree.children
+        self.assertEqual(module.kind, "module")
+        kinds = set()
+        stack = [module]
+        while stack:
+            g = stack.pop()
+            kinds.add(g.kind)
+            stack.extend(c for c in g.children if isinstance(c, ir.Group))
+        self.assertLessEqual({"function", "statement", "math", "pattern"}, kinds)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "f.py")
+            with open(path, "w") as fp:
+                fp.write(self.source)
+            cache = os.path.join(d, "cache")
+            outputs = []
+            for argv in (["-3", path], ["-p", path], ["-3", path]):
+                with io.StringIO() as buf:
+                    with contextlib.redirect_stdout(buf):
+                        main(["--ir-cache", cache] + argv)
+                    outputs.append(buf.getvalue())
+            self.assertEqual(len(os.listdir(cache)), 1)
+            self.assertEqual(outputs[0], outputs[2])
+            self.assertTrue(outputs[0].endswith(self.direct_output()))
+            self.assertTrue(outputs[1].startswith(r"\documentclass"))
+            (name,) = os.listdir(cache)
+            for data in (b"", b"\x80\x04garbage"):
+                with open(os.path.join(cache, name), "wb") as fp:
+                    fp.write(data)
+                with io.StringIO() as buf:
+                    with contextlib.redirect_stdout(buf):
+                        main(["--ir-cache", cache, "-3", path])
+                    self.assertEqual(buf.getvalue(), outputs[0])
+            self.assertEqual(os.listdir(cache), [name])
+
+    def test_parallel(self):
+        source = "\n".join(
+            [self.source.replace("f(", "f%s(" % i) for i in range(5)]
+            + ['PATTERNS = [("len(a)", "size(#a)")]', 'GLOBALS = "f0".split()']
+            + [self.source.replace("f(", "g%s(" % i) for i in range(5)]
+            + ["def h(x):\n    del x\n"]
+        )
+        sequential = build_ir(source, "<test>")
+        parallel = build_ir(source, "<test>", jobs=2)
+        self.assertEqual(sequential, parallel)
+        self.assertIn("size(i)", parallel.text())
+        self.assertIn("% Not handled:", parallel.text())
+
+
+class LintTest(unittest.TestCase):
+    source = (
+        "def f(a, n):\n"
+        "    for i in range(n):\n"
+        "        x = min(len(a), max(i, 2)) // 2\n"
+        "        print(x)\n"
+        "    while True:\n"
+        "        assert a == None\n"
+        "        continue\n"
+        "    return float('inf')\n"
+    )
+
+    def render(self, order=None):
+        o = ast.parse(self.source)
+        p = collections.defaultdict(int)
+        with io.StringIO() as buf:
+            visitor = Visitor(
+                print=functools.partial(print, file=buf),
+                source=self.source,
+                pattern_stats=p,
+            )
+            if order is not None:
+                visitor.patterns = [visitor.patterns[i] for i in order]
+            visitor.visit(o)
+            return buf.getvalue(), visitor.patterns, p
+
+    def test_reorder(self):
+        output, patterns, hits = self.render()
+        self.assertEqual(shadowed_patterns(patterns), {})
+        order = optimized_order(patterns, hits)
+        self.assertNotEqual(order, sorted(order))
+        self.assertEqual(self.render(order)[0], output)
+        # Prefer late patterns to reorder as much as possible
+        order = optimized_order(patterns, list(range(len(patterns))))
+        self.assertEqual(self.render(order)[0], output)
+
+    def test_shadowed(self):
+        visitor = Visitor(source="")
+        visitor.extend_patterns([("len(s)", r"#s.\mathit{length}")])
+        shadowed = shadowed_patterns(visitor.patterns)
+        self.assertEqual(list(shadowed.values()), [0])
+        (i,) = shadowed.keys()
+        self.assertEqual(visitor.patterns[i][0].source, "len(a)")
+
 
 class ExampleTests(unittest.TestCase):
     def _init():
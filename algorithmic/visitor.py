@@ -1,7 +1,9 @@
 import re
 import ast
 import sys
+import functools
 from .pattern import Pattern
+from .ir import no_group, node_kind
 
 
 GLOBALS = "len min max float print set range".split()
@@ -40,6 +42,10 @@ PATTERNS = [
     ("while cond: body\n", "\\WHILE{$#cond$}\n#body\\ENDWHILE"),
 ]
 
+# Top-level assignments that configure the rendering of a module
+PO_PATTERNS = Pattern.compile("PATTERNS = p", globals={"PATTERNS"})
+PO_GLOBALS = Pattern.compile("GLOBALS = s.split()", globals={"GLOBALS"})
+
 
 class VisitorBase(ast.NodeVisitor):
     dump_unhandled = False
@@ -88,11 +94,41 @@ class Visitor(VisitorBase):
     def __init__(self, *args, **kwargs):
         self.pattern_stats = kwargs.pop("pattern_stats", None)
         self.print = kwargs.pop("print", print)
+        # An ir.Builder passed as `print` records a tree of groups.
+        self.group = getattr(self.print, "group", no_group)
+        if self.group is not no_group:
+            self.visit = self.visit_grouped
         super().__init__(*args, **kwargs)
         self.patterns = []
         self.globals = frozenset(GLOBALS)
         self.extend_patterns(PATTERNS)
 
+    @property
+    def patterns(self):
+        return self._patterns
+
+    @patterns.setter
+    def patterns(self, patterns):
+        self._patterns = patterns
+        self._patterns_by_type = {}
+
+    def patterns_for(self, node_type):
+        """
+        Return a list of (index, pattern, repl) of the patterns that can
+        match a node of the given type, so that nodes which no pattern
+        targets (most names and numbers) skip the matching entirely.
+        """
+        try:
+            return self._patterns_by_type[node_type]
+        except KeyError:
+            pass
+        result = self._patterns_by_type[node_type] = [
+            (i, pattern, repl)
+            for i, (pattern, repl) in enumerate(self._patterns)
+            if pattern.root_type in (None, node_type)
+        ]
+        return result
+
     def extend_patterns(self, patterns):
         self.patterns = [
             (Pattern.compile(k, globals=self.globals), v) for k, v in patterns
@@ -104,6 +140,7 @@ class Visitor(VisitorBase):
         return r"\textsc{%s}" % (tex,)
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def tex_variable(v):
         o = re.fullmatch(r"(.*?)(?:_(.)|(\d+))", v)
         if o:
@@ -182,39 +219,77 @@ class Visitor(VisitorBase):
         return Visitor.node_name(node) == name
 
     def visit(self, node):
-        for i, (pattern, repl) in enumerate(self.patterns):
-            if pattern.sub(node, repl, print=self.print, visit=self.visit):
+        for i, pattern, repl in self.patterns_for(type(node)):
+            mo = pattern.match(node)
+            if mo is None:
+                continue
+            if pattern.apply(mo, repl, print=self.print, visit=self.visit):
                 if self.pattern_stats is not None:
                     self.pattern_stats[i] += 1
                 break
         else:
             super().visit(node)
 
+    def visit_grouped(self, node):
+        """
+        Same as visit, but record the node and the applied pattern as
+        groups of the ir.Builder passed as `print`.
+        """
+        with self.group(node_kind(node), type(node).__name__):
+            for i, pattern, repl in self.patterns_for(type(node)):
+                mo = pattern.match(node)
+                if mo is None:
+                    continue
+                with self.group("pattern", i):
+                    applied = pattern.apply(
+                        mo, repl, print=self.print, visit=self.visit
+                    )
+                if applied:
+                    if self.pattern_stats is not None:
+                        self.pattern_stats[i] += 1
+                    break
+            else:
+                super().visit(node)
+
     ## Top level
 
     def visit_Module(self, node):
-        print = self.print
-        print(r"\providecommand{\eq}{=}")
-        print(r"\providecommand{\emptystring}{\text{empty string}}")
-        po_pattern = Pattern.compile("PATTERNS = p", globals={"PATTERNS"})
-        po_globals = Pattern.compile("GLOBALS = s.split()", globals={"GLOBALS"})
+        self.module_header()
         for child in node.body:
             if isinstance(child, ast.FunctionDef):
                 self.visit(child)
-            elif po_pattern.match(child):
-                p = ast.literal_eval(po_pattern.match(child)["p"])
-                self.extend_patterns(p)
-            elif po_globals.match(child):
-                s = ast.literal_eval(po_globals.match(child)["s"]).split()
-                self.globals = self.globals | frozenset(s)
-            # else:
-            #     print(r'\begin{algorithmic}[1]')
-            #     self.visit(child)
-            #     print(r'\end{algorithmic}')
+            else:
+                self.module_statement(child)
+        self.module_footer()
+
+    def module_header(self):
+        self.print(r"\providecommand{\eq}{=}")
+        self.print(r"\providecommand{\emptystring}{\text{empty string}}")
+
+    def module_statement(self, child):
+        """
+        Handle a top-level statement other than a function definition.
+        Only PATTERNS and GLOBALS assignments have an effect,
+        namely on the functions that follow them.
+        """
+        mo_pattern = PO_PATTERNS.match(child)
+        mo_globals = PO_GLOBALS.match(child)
+        if mo_pattern is not None:
+            p = ast.literal_eval(mo_pattern["p"])
+            self.extend_patterns(p)
+        elif mo_globals is not None:
+            s = ast.literal_eval(mo_globals["s"]).split()
+            self.globals = self.globals | frozenset(s)
+        # else:
+        #     print(r'\begin{algorithmic}[1]')
+        #     self.visit(child)
+        #     print(r'\end{algorithmic}')
+
+    def module_footer(self):
         if self.unhandled:
-            print("% Not handled:")
+            self.print("% Not handled:")
             for n in sorted(self.unhandled):
-                print("%% %s" % (n,))
+                self.print("%% %s" % (n,))
 
     def visit_FunctionDef(self, node):
         if node.name.startswith("_"):